@@ -1,11 +1,17 @@
 import os
 import json
-from flask import Flask, request, jsonify
+import threading
+import time
+from datetime import date, timedelta
+from flask import Flask, Response, g, request, jsonify
 from dotenv import load_dotenv
 
-from services.imap_service import extract_order_number, search_amazon_email
-from services.ynab_service import get_categories
-from services.claude_service import suggest_category
+from services.imap_service import extract_order_number, search_amazon_email, search_amazon_emails
+from services.ynab_service import get_categories, get_transactions
+from services.claude_service import suggest_category, suggest_categories
+from services.classifier_service import get_classifier, confirm_approved, confirm_category, extract_products
+from services.singleflight import SingleFlight
+from services import metrics
 
 # Load .env from same directory as main.py
 load_dotenv()
@@ -14,6 +20,23 @@ app = Flask(__name__)
 
 API_SECRET = os.getenv('API_SECRET')
 
+# Concurrent /categorize and /categorize/batch calls for the same order share one computation;
+# successful results are reused for retries within the TTL.
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '60'))
+_single_flight = SingleFlight(
+    ttl=float(os.getenv('SINGLE_FLIGHT_TTL', '120')),
+    keep=lambda outcome: outcome[1] == 200
+)
+
+# Held Claude suggestions are confirmed from transactions approved in YNAB,
+# checked every CONFIRM_SYNC_INTERVAL seconds (0 disables it)
+CONFIRM_SYNC_INTERVAL = float(os.getenv('CONFIRM_SYNC_INTERVAL', '600'))
+CONFIRM_SYNC_DAYS = 60
+_sync_lock = threading.Lock()
+_sync_thread = None
+_sync_thread_lock = threading.Lock()
+_server_knowledge = None
+
 
 def _validate_secret(req) -> bool:
     """
@@ -26,12 +49,214 @@ def _validate_secret(req) -> bool:
     return secret == API_SECRET
 
 
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    """Count every request and its latency per route."""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUESTS.labels(endpoint=endpoint, status=str(response.status_code)).inc()
+    if 'request_start' in g:
+        metrics.REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - g.request_start)
+    return response
+
+
+def _predict_locally(classifier, email_body):
+    """
+    Ask the local classifier, counting hits and misses. The products of a
+    local answer are taken from this order's email.
+    """
+    suggestion = classifier.predict(email_body)
+    metrics.CACHE_REQUESTS.labels(cache='classifier', result='hit' if suggestion else 'miss').inc()
+    if not suggestion:
+        return None
+    metrics.RESULTS.labels(source='local').inc()
+    return {**suggestion, 'products': extract_products(email_body)}
+
+
+def _remember(order_number, email_body, suggestion):
+    """Hold a Claude suggestion until it is confirmed; never fails a request."""
+    try:
+        get_classifier().remember_suggestion(order_number, email_body, suggestion)
+    except Exception as e:
+        print(f"[Classifier] Could not hold suggestion: {e}", flush=True)
+    _start_confirmation_sync()
+
+
+def sync_confirmations() -> int:
+    """
+    Learn the categories of held orders whose YNAB transactions were
+    approved since the last sync. Returns the number of learned orders.
+    """
+    global _server_knowledge
+    with _sync_lock:
+        if not get_classifier().pending_orders():
+            return 0
+        since_date = (date.today() - timedelta(days=CONFIRM_SYNC_DAYS)).isoformat()
+        transactions, server_knowledge = get_transactions(since_date, _server_knowledge)
+        learned = confirm_approved(transactions, get_categories()) if transactions else 0
+        _server_knowledge = server_knowledge
+        return learned
+
+
+def _sync_confirmations_forever():
+    while True:
+        time.sleep(CONFIRM_SYNC_INTERVAL)
+        try:
+            learned = sync_confirmations()
+        except Exception as e:
+            print(f"[Classifier] Confirmation sync failed: {e}", flush=True)
+            continue
+        if learned:
+            print(f"[Classifier] Learned {learned} orders approved in YNAB", flush=True)
+
+
+def _start_confirmation_sync():
+    """Start the background confirmation sync once the first suggestion is held."""
+    global _sync_thread
+    if CONFIRM_SYNC_INTERVAL <= 0:
+        return
+    with _sync_thread_lock:
+        if _sync_thread is None:
+            _sync_thread = threading.Thread(target=_sync_confirmations_forever, name='confirmation-sync',
+                                            daemon=True)
+            _sync_thread.start()
+
+
+def _categorize_order(order_number):
+    """
+    Resolve one order number to a (response body, status) tuple.
+    Runs at most once at a time per order number, see _single_flight.
+    """
+    # Step 2: Search IMAP mailbox for matching email
+    try:
+        email_body = search_amazon_email(order_number)
+    except RuntimeError as e:
+        return {'error': f'IMAP error: {str(e)}'}, 500
+
+    if not email_body:
+        return {
+            'error': 'No Amazon order email found for this order number',
+            'order_number': order_number
+        }, 404
+
+    # Step 3: Answer familiar products from the local classifier
+    local_suggestion = _predict_locally(get_classifier(), email_body)
+    if local_suggestion:
+        return {
+            'order_number': order_number,
+            **local_suggestion,
+            'source': 'local'
+        }, 200
+
+    # Step 4: Fetch YNAB categories
+    try:
+        categories = get_categories()
+    except Exception as e:
+        return {'error': f'YNAB API error: {str(e)}'}, 500
+
+    # Step 5: Ask Claude to suggest a category
+    try:
+        suggestion = suggest_category(email_body, categories, order_number)
+    except Exception as e:
+        return {'error': f'Claude API error: {str(e)}'}, 500
+
+    metrics.RESULTS.labels(source='claude').inc()
+    _remember(order_number, email_body, suggestion)
+
+    return {
+        'order_number': order_number,
+        **suggestion,
+        'source': 'claude'
+    }, 200
+
+
+def _categorize_orders(order_numbers):
+    """
+    Resolve several order numbers to {order_number: (response body, status)}
+    like _categorize_order, fetching all emails over one IMAP session and
+    asking Claude about several orders per prompt.
+    """
+    outcomes = {}
+
+    # Step 2: Resolve all emails over one IMAP session
+    try:
+        email_bodies = search_amazon_emails(order_numbers)
+    except RuntimeError as e:
+        return {order_number: ({'error': f'IMAP error: {str(e)}'}, 500) for order_number in order_numbers}
+
+    classifier = get_classifier()
+    found = {}
+    for order_number in order_numbers:
+        email_body = email_bodies.get(order_number)
+        if isinstance(email_body, Exception):
+            outcomes[order_number] = {'error': f'IMAP error: {str(email_body)}'}, 500
+        elif not email_body:
+            outcomes[order_number] = {
+                'error': 'No Amazon order email found for this order number',
+                'order_number': order_number
+            }, 404
+        else:
+            # Step 3: Answer familiar products from the local classifier
+            local_suggestion = _predict_locally(classifier, email_body)
+            if local_suggestion:
+                outcomes[order_number] = {
+                    'order_number': order_number,
+                    **local_suggestion,
+                    'source': 'local'
+                }, 200
+            else:
+                found[order_number] = email_body
+
+    if not found:
+        return outcomes
+
+    # Step 4: Fetch YNAB categories once for the remaining orders
+    try:
+        categories = get_categories()
+    except Exception as e:
+        outcomes.update({order_number: ({'error': f'YNAB API error: {str(e)}'}, 500) for order_number in found})
+        return outcomes
+
+    # Step 5: Ask Claude to categorize several orders per prompt
+    try:
+        suggestions = suggest_categories(found, categories)
+    except Exception as e:
+        suggestions = {}
+        batch_error = f'Claude API error: {str(e)}'
+    else:
+        batch_error = 'Claude returned no suggestion for this order'
+
+    for order_number in found:
+        if order_number in suggestions:
+            metrics.RESULTS.labels(source='claude').inc()
+            _remember(order_number, found[order_number], suggestions[order_number])
+            outcomes[order_number] = {
+                'order_number': order_number,
+                **suggestions[order_number],
+                'source': 'claude'
+            }, 200
+        else:
+            outcomes[order_number] = {'error': batch_error}, 500
+    return outcomes
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Simple health check for Docker and monitoring."""
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics; unauthenticated like /health."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
 @app.route('/categorize', methods=['POST'])
 def categorize():
     """
@@ -47,7 +272,8 @@ def categorize():
         "order_number": "306-6340477-5787538",
         "category_id": "uuid",
         "category_name": "Shopping > Online Shopping",
-        "products": ["Item 1", "Item 2"]
+        "products": ["Item 1", "Item 2"],
+        "source": "local" | "claude"
     }
     """
     if not _validate_secret(request):
@@ -68,37 +294,180 @@ def categorize():
             'hint': 'Expected format: digits-digits-digits like 306-6340477-5787538'
         }), 400
 
-    # Step 2: Search IMAP mailbox for matching email
-    try:
-        email_body = search_amazon_email(order_number)
-    except RuntimeError as e:
-        return jsonify({'error': f'IMAP error: {str(e)}'}), 500
+    # Step 2-6: Resolve the order, sharing in-flight work for the same order
+    ran = []
 
-    if not email_body:
+    def run():
+        ran.append(True)
+        return _categorize_order(order_number)
+
+    try:
+        result, status = _single_flight.do(order_number, run, timeout=SINGLE_FLIGHT_TIMEOUT)
+    except TimeoutError:
+        metrics.CACHE_REQUESTS.labels(cache='single_flight', result='hit').inc()
         return jsonify({
-            'error': 'No Amazon order email found for this order number',
+            'error': 'Timed out waiting for in-flight categorization of this order',
             'order_number': order_number
-        }), 404
+        }), 504
+
+    metrics.CACHE_REQUESTS.labels(cache='single_flight', result='miss' if ran else 'hit').inc()
+    return jsonify(result), status
+
+
+@app.route('/categorize/batch', methods=['POST'])
+def categorize_batch():
+    """
+    POST /categorize/batch
+
+    Request body (JSON):
+    {
+        "transactions": [
+            "AMAZON PAYMENTS 306-6340477-5787538",
+            "AMZN Mktp DE 302-1234567-1234567"
+        ]
+    }
+
+    Transactions are deduplicated by order number. Orders in flight or
+    recently answered by /categorize or another batch share that result;
+    for the others all emails are fetched over a single IMAP session.
+    Orders the local classifier knows are answered in-process, the rest are
+    categorized by Claude with several orders per prompt. Errors (IMAP,
+    YNAB, Claude) are reported per result.
+
+    Response (JSON), one result per input transaction in the same order:
+    {
+        "results": [
+            {
+                "transaction": "AMAZON PAYMENTS 306-6340477-5787538",
+                "status": 200,
+                "order_number": "306-6340477-5787538",
+                "category_id": "uuid",
+                "category_name": "Shopping > Online Shopping",
+                "products": ["Item 1", "Item 2"],
+                "source": "local"
+            },
+            {
+                "transaction": "AMZN Mktp DE 302-1234567-1234567",
+                "status": 404,
+                "order_number": "302-1234567-1234567",
+                "error": "No Amazon order email found for this order number"
+            }
+        ]
+    }
+    """
+    if not _validate_secret(request):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body.get('transactions'), list):
+        return jsonify({'error': 'Request body must include a "transactions" list'}), 400
+
+    transactions = [str(t) for t in body['transactions']]
+
+    # Step 1: Extract and deduplicate order numbers
+    order_numbers_by_transaction = [extract_order_number(t) for t in transactions]
+    order_numbers = list(dict.fromkeys(o for o in order_numbers_by_transaction if o))
+
+    # Steps 2-5: Join orders in flight or cached from /categorize or other
+    # batches, and resolve only the remaining ones here
+    ran = set()
+
+    def run(remaining):
+        ran.update(remaining)
+        return _categorize_orders(remaining)
+
+    outcomes = _single_flight.do_many(order_numbers, run, timeout=SINGLE_FLIGHT_TIMEOUT)
+    for order_number in order_numbers:
+        metrics.CACHE_REQUESTS.labels(cache='single_flight',
+                                      result='miss' if order_number in ran else 'hit').inc()
+
+    # Step 6: Map results back onto the input transactions
+    results = []
+    for transaction_string, order_number in zip(transactions, order_numbers_by_transaction):
+        if not order_number:
+            results.append({
+                'transaction': transaction_string,
+                'status': 400,
+                'error': 'Could not extract Amazon order number from transaction string'
+            })
+            continue
+
+        outcome = outcomes[order_number]
+        if isinstance(outcome, TimeoutError):
+            outcome = {'error': 'Timed out waiting for in-flight categorization of this order'}, 504
+        elif isinstance(outcome, Exception):
+            outcome = {'error': str(outcome)}, 500
+        result, status = outcome
+        results.append({
+            'transaction': transaction_string,
+            'status': status,
+            'order_number': order_number,
+            **result
+        })
+
+    return jsonify({'results': results}), 200
+
+
+@app.route('/categorize/confirm', methods=['POST'])
+def categorize_confirm():
+    """
+    POST /categorize/confirm
+
+    Teach the local classifier the category a transaction was finally
+    booked to. Only confirmed categories are learned; Claude's suggestions
+    are held until then. Transactions the Comdirect importer created are
+    confirmed automatically once approved in YNAB (see sync_confirmations);
+    this endpoint covers other bookings and corrections.
+
+    Request body (JSON):
+    {
+        "transaction": "AMAZON PAYMENTS 306-6340477-5787538",
+        "category_id": "uuid"
+    }
+
+    "order_number" may be sent instead of "transaction". Without a held
+    suggestion for the order its email is fetched again.
+
+    Response (JSON):
+    {
+        "order_number": "306-6340477-5787538",
+        "category_id": "uuid",
+        "category_name": "Shopping > Online Shopping"
+    }
+    """
+    if not _validate_secret(request):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    body = request.get_json(silent=True) or {}
+    order_number = body.get('order_number') or extract_order_number(str(body.get('transaction', '')))
+    if not order_number or not body.get('category_id'):
+        return jsonify({'error': 'Request body must include "category_id" and "transaction" or "order_number"'}), 400
 
-    # Step 3: Fetch YNAB categories
     try:
         categories = get_categories()
     except Exception as e:
         return jsonify({'error': f'YNAB API error: {str(e)}'}), 500
 
-    # Step 4: Ask Claude to suggest a category
-    try:
-        suggestion = suggest_category(email_body, categories, order_number)
-    except Exception as e:
-        return jsonify({'error': f'Claude API error: {str(e)}'}), 500
+    email_body = None
+    if get_classifier().pending(order_number) is None:
+        try:
+            email_body = search_amazon_email(order_number)
+        except RuntimeError as e:
+            return jsonify({'error': f'IMAP error: {str(e)}'}), 500
+        if not email_body:
+            return jsonify({
+                'error': 'No Amazon order email found for this order number',
+                'order_number': order_number
+            }), 404
 
-    # Step 5: Return the result
-    return jsonify({
-        'order_number': order_number,
-        **suggestion
-    }), 200
+    category = confirm_category(order_number, body['category_id'], categories, email_body)
+    if not category:
+        return jsonify({'error': 'Unknown YNAB category', 'category_id': body['category_id']}), 400
+
+    return jsonify({'order_number': order_number, **category}), 200
 
 
 if __name__ == '__main__':
-    # Development only - gunicorn is used in Docker
+    # Development only - gunicorn is used in Docker. Run from this directory
+    # with the repository root on the path for base/: PYTHONPATH=.. python main.py
     app.run(host='0.0.0.0', port=5000, debug=False)
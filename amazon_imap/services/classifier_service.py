@@ -0,0 +1,311 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+
+TOKEN_PATTERN = re.compile(r'[a-zäöüß][a-zäöüß0-9\-]+')
+# Leading article numbers and SKUs like "SFGSUP" or "B08XYZ1234"
+PRODUCT_CODE_PATTERN = re.compile(r'^[A-Z0-9]{6,}$')
+# Memo the Comdirect importer writes for categorized Amazon transactions
+ORDER_MEMO_PATTERN = re.compile(r'^Amazon Order (\d{3}-\d{7}-\d{7}):')
+
+
+def _tokenize(text: str) -> Counter:
+    """Lowercase word counts, ignoring pure numbers (prices, order numbers)."""
+    return Counter(TOKEN_PATTERN.findall(text.lower()))
+
+
+def extract_products(email_body: str, limit: int = 3, max_length: int = 10) -> List[str]:
+    """
+    Short product names from the item lines ("<title> | Menge: <n> | <price>")
+    of an extracted order email, following Claude's product rules: leading
+    codes removed, whole words up to `max_length` characters, at most
+    `limit` products. Empty if the email has no recognized item lines.
+    """
+    products = []
+    for line in email_body.splitlines():
+        if ' | ' not in line:
+            continue
+        words = line.split(' | ')[0].split()
+        while len(words) > 1 and PRODUCT_CODE_PATTERN.match(words[0]):
+            words.pop(0)
+        if not words:
+            continue
+        name = words[0][:max_length]
+        for word in words[1:]:
+            if len(name) + 1 + len(word) > max_length:
+                break
+            name += ' ' + word
+        products.append(name)
+        if len(products) == limit:
+            break
+    return products
+
+
+class LocalClassifier:
+    """
+    TF-IDF nearest-neighbor classifier over past (email text -> category)
+    decisions. Answers in-process when the nearest neighbors agree with
+    high similarity; otherwise the caller falls back to Claude.
+
+    Samples are appended to a JSON lines file so the training data survives
+    restarts and grows with every confirmed categorization. Claude's
+    suggestions are not training data: they are only held (in memory, up to
+    `max_pending`) until the categorization is confirmed.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.8, min_share: float = 0.7,
+                 neighbors: int = 5, max_samples: int = 5000, max_pending: int = 1000):
+        self.path = path
+        self.threshold = threshold
+        self.min_share = min_share
+        self.neighbors = neighbors
+        self.max_samples = max_samples
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._samples = []                  # list of {'terms', 'label'}
+        self._postings = defaultdict(set)   # term -> sample indices
+        self._doc_freq = Counter()
+        self._norms = None                  # lazily recomputed after learning
+        self._pending = OrderedDict()       # order number -> (terms, Claude suggestion)
+
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file_object:
+            for line in file_object:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._add(Counter(record['terms']), record['label'])
+        self._trim()
+
+    def _add(self, terms: Counter, label: Dict):
+        index = len(self._samples)
+        self._samples.append({'terms': terms, 'label': label})
+        for term in terms:
+            self._postings[term].add(index)
+            self._doc_freq[term] += 1
+        self._norms = None
+
+    def _rebuild(self, samples: List[Dict]):
+        self._samples = []
+        self._postings = defaultdict(set)
+        self._doc_freq = Counter()
+        for sample in samples:
+            self._add(sample['terms'], sample['label'])
+
+    def _trim(self):
+        """Keep only the newest max_samples samples and rewrite the file."""
+        if len(self._samples) > self.max_samples:
+            self._rebuild(self._samples[-self.max_samples:])
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file_object:
+            for sample in self._samples:
+                file_object.write(json.dumps({'terms': sample['terms'], 'label': sample['label']}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _idf(self, term: str) -> float:
+        return math.log((len(self._samples) + 1) / (self._doc_freq[term] + 1)) + 1
+
+    def _sample_norms(self) -> List[float]:
+        if self._norms is None:
+            self._norms = [
+                math.sqrt(sum((count * self._idf(term)) ** 2 for term, count in sample['terms'].items()))
+                for sample in self._samples
+            ]
+        return self._norms
+
+    def predict(self, text: str) -> Optional[Dict]:
+        """
+        Return the category ('category_id', 'category_name') of the nearest
+        neighbors if they are confident, else None. Products are not
+        returned, they belong to the neighbor's order, see extract_products.
+        """
+        terms = _tokenize(text)
+        if not terms:
+            return None
+
+        with self._lock:
+            if not self._samples:
+                return None
+
+            norms = self._sample_norms()
+            weights = {term: count * self._idf(term) for term, count in terms.items()}
+            query_norm = math.sqrt(sum(w * w for w in weights.values()))
+
+            # Dot products only over samples sharing at least one term
+            scores = defaultdict(float)
+            for term, weight in weights.items():
+                idf = self._idf(term)
+                for index in self._postings.get(term, ()):
+                    scores[index] += weight * self._samples[index]['terms'][term] * idf
+
+            if not scores:
+                return None
+
+            ranked = sorted(
+                ((score / (query_norm * norms[index]), index) for index, score in scores.items()),
+                reverse=True
+            )[:self.neighbors]
+
+            best_similarity, best_index = ranked[0]
+            if best_similarity < self.threshold:
+                return None
+
+            # Similarity-weighted vote among the nearest neighbors
+            votes = defaultdict(float)
+            for similarity, index in ranked:
+                votes[self._samples[index]['label']['category_id']] += similarity
+            best_label = self._samples[best_index]['label']
+            if votes[best_label['category_id']] / sum(votes.values()) < self.min_share:
+                return None
+
+            return {'category_id': best_label['category_id'], 'category_name': best_label['category_name']}
+
+    def remember_suggestion(self, order_number: str, text: str, suggestion: Dict):
+        """Hold a Claude suggestion until its categorization is confirmed."""
+        terms = _tokenize(text)
+        if not terms:
+            return
+        with self._lock:
+            self._pending[order_number] = (terms, suggestion)
+            self._pending.move_to_end(order_number)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+    def pending_orders(self) -> List[str]:
+        """Order numbers with an unconfirmed Claude suggestion."""
+        with self._lock:
+            return list(self._pending)
+
+    def pending(self, order_number: str) -> Optional[Dict]:
+        """The unconfirmed Claude suggestion held for an order, or None."""
+        with self._lock:
+            entry = self._pending.get(order_number)
+        return entry[1] if entry else None
+
+    def confirm(self, order_number: str, category: Dict, text: Optional[str] = None) -> bool:
+        """
+        Learn the confirmed category of an order from the email text held
+        with its suggestion, or from `text`. Returns False without either.
+        """
+        with self._lock:
+            entry = self._pending.pop(order_number, None)
+        if entry:
+            self._learn_terms(entry[0], category)
+            return True
+        if text:
+            self.learn(text, category)
+            return True
+        return False
+
+    def learn(self, text: str, suggestion: Dict):
+        """Record a confirmed (email text -> category) decision."""
+        self._learn_terms(_tokenize(text), suggestion)
+
+    def _learn_terms(self, terms: Counter, suggestion: Dict):
+        if not terms or not suggestion.get('category_id'):
+            return
+
+        label = {
+            'category_id': suggestion['category_id'],
+            'category_name': suggestion.get('category_name')
+        }
+
+        with self._lock:
+            self._add(terms, label)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file_object:
+                file_object.write(json.dumps({'terms': terms, 'label': label}) + '\n')
+            self._trim()
+
+    def prune(self, valid_category_ids: Iterable[str]):
+        """Drop samples whose category no longer exists in YNAB."""
+        valid = set(valid_category_ids)
+        with self._lock:
+            kept = [s for s in self._samples if s['label']['category_id'] in valid]
+            if len(kept) != len(self._samples):
+                self._rebuild(kept)
+                self._save()
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> LocalClassifier:
+    """Process-wide classifier configured from the environment."""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = LocalClassifier(
+                path=os.getenv('CLASSIFIER_PATH', 'data/classifier_samples.jsonl'),
+                threshold=float(os.getenv('CLASSIFIER_THRESHOLD', '0.8')),
+                min_share=float(os.getenv('CLASSIFIER_MIN_SHARE', '0.7'))
+            )
+        return _classifier
+
+
+def confirm_category(order_number: str, category_id: str, categories: List[Dict],
+                     email_body: Optional[str] = None) -> Optional[Dict]:
+    """
+    Learn a confirmed categorization if category_id is a real YNAB
+    category, and prune samples for deleted categories. The email text is
+    taken from the held Claude suggestion, else from `email_body`.
+
+    Returns the learned category, or None if the category is unknown or
+    there is no email text for the order.
+    """
+    classifier = get_classifier()
+    valid = {cat['id']: cat for cat in categories}
+    classifier.prune(valid)
+    if category_id not in valid:
+        return None
+    category = {'category_id': category_id, 'category_name': valid[category_id]['full_name']}
+    if not classifier.confirm(order_number, category, email_body):
+        return None
+    return category
+
+
+def confirm_approved(transactions: Iterable[Dict], categories: List[Dict]) -> int:
+    """
+    Confirm held suggestions from YNAB transactions the user approved.
+
+    A transaction confirms an order if its memo has the Comdirect importer's
+    "Amazon Order <number>:" layout and it is approved with a single
+    category; the category it was approved with is learned, whether the
+    user kept or corrected the suggestion. Returns the number of learned
+    orders.
+    """
+    pending = set(get_classifier().pending_orders())
+    learned = 0
+    for transaction in transactions:
+        if transaction.get('deleted') or not transaction.get('approved') or not transaction.get('category_id'):
+            continue
+        match = ORDER_MEMO_PATTERN.match(transaction.get('memo') or '')
+        if not match or match.group(1) not in pending:
+            continue
+        if confirm_category(match.group(1), transaction['category_id'], categories):
+            pending.discard(match.group(1))
+            learned += 1
+    return learned
@@ -2,31 +2,81 @@ import os
 import requests
 import json
 import re
-from typing import List, Dict
+import time
+from functools import lru_cache
+from typing import List, Dict, Tuple
 
+from services.metrics import CLAUDE_SECONDS, CLAUDE_TOKENS
 
-def suggest_category(
-    email_body: str,
-    categories: List[Dict],
-    order_number: str
-) -> Dict:
-    """
-    Send the Amazon order email content and YNAB categories to Claude
-    via the Claude API REST endpoint and receive a category suggestion.
 
-    Returns dict with 'category_id', 'category_name', 'products'
+# Maximum number of orders sent to Claude in one batch prompt
+BATCH_SIZE = int(os.getenv('CLAUDE_BATCH_SIZE', '10'))
+# Claude Haiku 4.5 only caches prompt prefixes of at least this many tokens;
+# shorter system prompts are sent in full with every call
+CACHE_MIN_TOKENS = 4096
+
+PRODUCT_RULES = '''PRODUCT EXTRACTION RULES:
+- Remove cryptic codes at the start (like SFGSUP, ASINs, SKUs)
+- Keep the meaningful product description
+- Truncate to max 10 characters per product name
+- Extract up to 3 main products
+
+EXAMPLES:
+- "SFGSUP E Bike Bicycle Rear Light" → "E Bike Rear"
+- "USB-C Cable High Speed" → "USB-C Cable"
+- "Wireless Earbuds Pro Max" → "Wireless Ear"'''
+
+RESPONSE_FORMATS = '''RESPONSE FORMATS:
+Respond with ONLY JSON (no markdown, no extra text).
+
+For a single order, one object:
+{
+  "category_id": "exact-uuid-from-list",
+  "category_name": "Group > Category",
+  "products": ["product1", "product2"]
+}
+
+For several orders, an array with one object per order, where "index" is
+the number in the order's "=== ORDER <index> ===" header:
+[
+  {
+    "index": 1,
+    "category_id": "exact-uuid-from-list",
+    "category_name": "Group > Category",
+    "products": ["product1", "product2"]
+  }
+]'''
+
+# Set once a reply showed that the system prompt is too short to be cached
+_cache_warned = False
+
+
+def _category_key(categories: List[Dict]) -> Tuple:
+    """Hashable version key of a category tree (changes when YNAB changes)."""
+    return tuple((cat['group'], cat['name'], cat['id']) for cat in categories)
+
+
+@lru_cache(maxsize=8)
+def _system_prompt(category_key: Tuple) -> str:
     """
-    api_key = os.getenv('CLAUDE_API_KEY')
+    Render the static part of the prompt for one category tree version:
+    instructions, the Group > Category tree with IDs, the product rules and
+    both response formats.
 
+    Rendered once per tree version and sent as a cached prompt prefix, so
+    only the email content is new input tokens per call. All fixed
+    instructions live here to make the prefix as long as possible, but
+    Haiku 4.5 only caches it from CACHE_MIN_TOKENS tokens on, which small
+    category trees do not reach (see _check_cached).
+    """
     # Build the category tree organized by groups
     category_tree = {}
-    for cat in categories:
-        group = cat['group']
+    for group, name, cat_id in category_key:
         if group not in category_tree:
             category_tree[group] = []
         category_tree[group].append({
-            'id': cat['id'],
-            'name': cat['name']
+            'id': cat_id,
+            'name': name
         })
 
     # Format tree for Claude (Group > Category with IDs)
@@ -36,35 +86,52 @@ def suggest_category(
         for cat in sorted(cats, key=lambda x: x['name']):
             category_list += f"  - {cat['name']} [ID: {cat['id']}]\n"
 
-    user_message = f"""Analyze this Amazon order email and suggest the best YNAB category.
-
-Order Number: {order_number}
-
-EMAIL CONTENT:
-{email_body}
+    return f"""You analyze Amazon order emails and suggest the best YNAB category.
 
 YOUR YNAB CATEGORIES (organized by group):
 {category_list}
 
-PRODUCT EXTRACTION RULES:
-- Remove cryptic codes at the start (like SFGSUP, ASINs, SKUs)
-- Keep the meaningful product description
-- Truncate to max 10 characters per product name
-- Extract up to 3 main products
+{PRODUCT_RULES}
 
-EXAMPLES:
-- "SFGSUP E Bike Bicycle Rear Light" → "E Bike Rear"
-- "USB-C Cable High Speed" → "USB-C Cable"
-- "Wireless Earbuds Pro Max" → "Wireless Ear"
+Choose the SINGLE BEST matching category from the YNAB tree above.
 
-Choose the SINGLE BEST matching category from your YNAB tree above.
+{RESPONSE_FORMATS}"""
 
-Respond with ONLY a JSON object (no markdown, no extra text):
-{{
-  "category_id": "exact-uuid-from-list",
-  "category_name": "Group > Category",
-  "products": ["product1", "product2"]
-}}"""
+
+def _count_tokens(usage: Dict):
+    """Add the token counts of one Claude response to the metrics."""
+    for token_type, field in (
+        ('input', 'input_tokens'),
+        ('output', 'output_tokens'),
+        ('cache_read', 'cache_read_input_tokens'),
+        ('cache_creation', 'cache_creation_input_tokens')
+    ):
+        if usage.get(field):
+            CLAUDE_TOKENS.labels(type=token_type).inc(usage[field])
+
+
+def _check_cached(usage: Dict):
+    """
+    Log once if the system prompt was neither read from nor written to the
+    prompt cache, i.e. it is below CACHE_MIN_TOKENS and caching is not
+    happening.
+    """
+    global _cache_warned
+    if _cache_warned or usage.get('cache_read_input_tokens') or usage.get('cache_creation_input_tokens'):
+        return
+    _cache_warned = True
+    print(f"[Claude] System prompt is not cached: {usage.get('input_tokens')} input tokens, "
+          f"Haiku 4.5 caches prefixes of at least {CACHE_MIN_TOKENS} tokens", flush=True)
+
+
+def _call_claude(system_prompt: str, user_message: str, max_tokens: int = 256) -> str:
+    """
+    Send a user message to the Claude API and return the reply text.
+
+    The system prompt is marked with cache_control so repeated calls with
+    the same category tree read it from Anthropic's prompt cache.
+    """
+    api_key = os.getenv('CLAUDE_API_KEY')
 
     headers = {
         'Content-Type': 'application/json',
@@ -74,32 +141,125 @@ Respond with ONLY a JSON object (no markdown, no extra text):
 
     payload = {
         'model': 'claude-haiku-4-5-20251001',
-        'max_tokens': 256,
+        'max_tokens': max_tokens,
+        'system': [
+            {
+                'type': 'text',
+                'text': system_prompt,
+                'cache_control': {'type': 'ephemeral'}
+            }
+        ],
         'messages': [
             {'role': 'user', 'content': user_message}
         ]
     }
 
-    response = requests.post(
-        'https://api.anthropic.com/v1/messages',
-        headers=headers,
-        json=payload,
-        timeout=30
-    )
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        response = requests.post(
+            'https://api.anthropic.com/v1/messages',
+            headers=headers,
+            json=payload,
+            timeout=30
+        )
+        outcome = str(response.status_code)
+    finally:
+        CLAUDE_SECONDS.labels(outcome=outcome).observe(time.perf_counter() - start)
     response.raise_for_status()
 
     data = response.json()
-    response_text = data['content'][0]['text'].strip()
+    usage = data.get('usage') or {}
+    _count_tokens(usage)
+    _check_cached(usage)
+    return data['content'][0]['text'].strip()
 
+
+def _parse_json(response_text: str, pattern: str = r'\{.*\}'):
+    """Parse a JSON reply from Claude, tolerating markdown code fences."""
     # Parse JSON response - Claude should return clean JSON
     try:
-        result = json.loads(response_text)
+        return json.loads(response_text)
     except json.JSONDecodeError:
         # If wrapped in code blocks, extract the JSON
-        match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        match = re.search(pattern, response_text, re.DOTALL)
         if match:
-            result = json.loads(match.group(0))
-        else:
-            raise ValueError(f"Could not parse Claude response: {response_text}")
+            return json.loads(match.group(0))
+        raise ValueError(f"Could not parse Claude response: {response_text}")
+
+
+def suggest_category(
+    email_body: str,
+    categories: List[Dict],
+    order_number: str
+) -> Dict:
+    """
+    Send the Amazon order email content and YNAB categories to Claude
+    via the Claude API REST endpoint and receive a category suggestion.
+
+    Returns dict with 'category_id', 'category_name', 'products'
+    """
+    system_prompt = _system_prompt(_category_key(categories))
+
+    user_message = f"""Analyze this Amazon order email and suggest the best YNAB category.
+
+Order Number: {order_number}
+
+EMAIL CONTENT:
+{email_body}
+
+Respond in the single order format."""
+
+    return _parse_json(_call_claude(system_prompt, user_message))
+
+
+def suggest_categories(
+    orders: Dict[str, str],
+    categories: List[Dict]
+) -> Dict[str, Dict]:
+    """
+    Categorize several Amazon orders with as few Claude calls as possible.
+
+    `orders` maps order number to email body. Orders are sent in chunks of
+    BATCH_SIZE per prompt, so the category tree is only sent once per
+    chunk. Returns a dict mapping order number to the suggestion dict
+    ('category_id', 'category_name', 'products'). A failed chunk (API error
+    or unparsable reply) is logged and skipped, so orders Claude did not
+    answer for are missing from the result while other chunks still count.
+    """
+    system_prompt = _system_prompt(_category_key(categories))
+    order_numbers = list(orders.keys())
+    results = {}
+
+    for start in range(0, len(order_numbers), BATCH_SIZE):
+        chunk = order_numbers[start:start + BATCH_SIZE]
+
+        email_blocks = ""
+        for index, order_number in enumerate(chunk, 1):
+            email_blocks += f"\n=== ORDER {index} ===\nOrder Number: {order_number}\n{orders[order_number]}\n"
+
+        user_message = f"""Analyze these Amazon order emails and suggest the best YNAB category for each order.
+
+{email_blocks}
+Respond in the format for several orders."""
+
+        try:
+            response_text = _call_claude(system_prompt, user_message, max_tokens=256 * len(chunk))
+            suggestions = _parse_json(response_text, pattern=r'\[.*\]')
+        except Exception as e:
+            print(f"[Claude] Batch of {len(chunk)} orders failed: {e}", flush=True)
+            continue
+
+        if not isinstance(suggestions, list):
+            print(f"[Claude] Batch reply is not a JSON array: {response_text}", flush=True)
+            continue
+
+        for suggestion in suggestions:
+            if not isinstance(suggestion, dict):
+                continue
+            index = suggestion.pop('index', None)
+            suggestion.pop('order_number', None)
+            if isinstance(index, int) and 1 <= index <= len(chunk):
+                results[chunk[index - 1]] = suggestion
 
-    return result
+    return results
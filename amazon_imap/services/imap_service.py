@@ -1,9 +1,13 @@
 import imaplib
 import email
 import email.header
+import email.message
 import re
 import os
-from typing import Optional
+from html.parser import HTMLParser
+from typing import Optional, List, Dict
+
+from services.metrics import IMAP_SECONDS, timed
 
 
 def extract_order_number(transaction_string: str) -> Optional[str]:
@@ -21,64 +25,241 @@ def extract_order_number(transaction_string: str) -> Optional[str]:
     return None
 
 
-def search_amazon_email(order_number: str) -> Optional[str]:
-    """
-    Connect to IMAP mailbox and search for the Amazon order confirmation
-    email matching the given order number.
-
-    Searches in email body (not just subject) since order number appears in text.
-    Returns the plain text or HTML body of the email, or None if not found.
-    """
+def _connect() -> imaplib.IMAP4_SSL:
+    """Open an authenticated IMAP session with INBOX selected."""
     host = os.getenv('IMAP_HOST', 'imap.hostinger.com')
     port = int(os.getenv('IMAP_PORT', '993'))
     user = os.getenv('HOSTINGER_EMAIL')
     password = os.getenv('HOSTINGER_PASSWORD')
 
-    try:
+    with timed(IMAP_SECONDS, operation='connect'):
         mail = imaplib.IMAP4_SSL(host, port)
         mail.login(user, password)
         mail.select('INBOX')
+    return mail
+
 
-        # Server-side search: BODY contains order number (searches in email text)
-        # This finds emails where the order number appears in the body
-        search_criteria = f'BODY "{order_number}"'
+def _fetch_order_email(mail: imaplib.IMAP4_SSL, order_number: str) -> Optional[str]:
+    """
+    Search an open IMAP session for the email matching the order number
+    and return its extracted body, or None if not found.
+    """
+    # Server-side search: BODY contains order number (searches in email text)
+    # This finds emails where the order number appears in the body
+    search_criteria = f'BODY "{order_number}"'
+    with timed(IMAP_SECONDS, operation='search'):
         status, message_ids = mail.search(None, search_criteria)
 
-        if status != 'OK' or not message_ids[0]:
-            # Fallback: search by subject if body search fails
-            search_criteria = f'SUBJECT "{order_number}"'
+    if status != 'OK' or not message_ids[0]:
+        # Fallback: search by subject if body search fails
+        search_criteria = f'SUBJECT "{order_number}"'
+        with timed(IMAP_SECONDS, operation='search'):
             status, message_ids = mail.search(None, search_criteria)
 
-            if status != 'OK' or not message_ids[0]:
-                mail.logout()
-                return None
+        if status != 'OK' or not message_ids[0]:
+            return None
 
-        # Take the last (most recent) match
-        ids = message_ids[0].split()
-        latest_id = ids[-1]
+    # Take the last (most recent) match
+    ids = message_ids[0].split()
+    latest_id = ids[-1]
 
-        # Fetch the full RFC822 message
+    # Fetch the full RFC822 message
+    with timed(IMAP_SECONDS, operation='fetch'):
         status, msg_data = mail.fetch(latest_id, '(RFC822)')
-        mail.logout()
 
-        if status != 'OK':
-            return None
+    if status != 'OK':
+        return None
+
+    raw_email = msg_data[0][1]
+    msg = email.message_from_bytes(raw_email)
 
-        raw_email = msg_data[0][1]
-        msg = email.message_from_bytes(raw_email)
+    # Extract body - prefer plain text, fall back to HTML
+    return _extract_body(msg)
 
-        # Extract body - prefer plain text, fall back to HTML
-        body = _extract_body(msg)
-        return body
+
+def search_amazon_email(order_number: str) -> Optional[str]:
+    """
+    Connect to IMAP mailbox and search for the Amazon order confirmation
+    email matching the given order number.
+
+    Searches in email body (not just subject) since order number appears in text.
+    Returns the plain text or HTML body of the email, or None if not found.
+    """
+    try:
+        mail = _connect()
+        try:
+            return _fetch_order_email(mail, order_number)
+        finally:
+            mail.logout()
 
     except Exception as e:
         raise RuntimeError(f"IMAP search failed: {e}") from e
 
 
+def search_amazon_emails(order_numbers: List[str]) -> Dict[str, object]:
+    """
+    Resolve several order numbers over a single IMAP session.
+
+    Returns a dict mapping each order number to its email body, None if
+    no email was found, or a RuntimeError if the lookup for that order
+    failed. A failed login raises RuntimeError for the whole batch.
+    """
+    results = {}
+    try:
+        mail = _connect()
+    except Exception as e:
+        raise RuntimeError(f"IMAP login failed: {e}") from e
+
+    try:
+        for order_number in order_numbers:
+            try:
+                results[order_number] = _fetch_order_email(mail, order_number)
+            except Exception as e:
+                results[order_number] = RuntimeError(f"IMAP search failed: {e}")
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    return results
+
+
+# Fallback limit when no order items can be recognized
+MAX_BODY_CHARS = 4000
+
+PRICE_PATTERN = re.compile(
+    r'(?:EUR|€)\s*-?\d{1,3}(?:\.\d{3})*,\d{2}'
+    r'|-?\d{1,3}(?:\.\d{3})*,\d{2}\s*(?:EUR|€)'
+    r'|\$\s*\d{1,3}(?:,\d{3})*\.\d{2}'
+)
+QUANTITY_PATTERN = re.compile(r'\b(?:Menge|Anzahl|Quantity|Qty|Stück)\s*:?\s*(\d+)', re.I)
+# Whole label words of subtotal, shipping, tax and payment rows
+BOILERPLATE_PATTERN = re.compile(
+    r'\b(?:(?:zwischen|gesamt)?summe|gesamt(?:betrag)?|endbetrag|versand(?:kosten)?|verpackung'
+    r'|mwst|ust|gutschein|rabatt|zahlung|zahlungsart|rechnung|lieferung|lieferadresse'
+    r'|(?:sub)?total|shipping|tax|payment|delivery|promotion)\b',
+    re.I
+)
+# Label rows ("Versand: 0,00 €", "Gesamtsumme inkl. MwSt.") have at most this many words
+MAX_LABEL_WORDS = 5
+
+
+class _HTMLTextParser(HTMLParser):
+    """Streaming HTML to text converter that keeps one line per block element."""
+
+    BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'td', 'th', 'li', 'table', 'h1', 'h2', 'h3', 'h4'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self._current = []
+        self._skip_depth = 0
+
+    def _flush(self):
+        if self._current:
+            line = ' '.join(' '.join(self._current).split())
+            if line:
+                self.lines.append(line)
+            self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._current.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def _html_to_lines(html: str) -> List[str]:
+    """Convert HTML to text lines in a single streaming pass."""
+    parser = _HTMLTextParser()
+    parser.feed(html)
+    parser.close()
+    return parser.lines
+
+
+def _is_label_row(line: str) -> bool:
+    """
+    A short subtotal/shipping/tax/payment row: a label word plus at most an
+    amount. Product titles merely containing such a word are not matched.
+    """
+    words = PRICE_PATTERN.sub(' ', line).split()
+    return len(words) <= MAX_LABEL_WORDS and bool(BOILERPLATE_PATTERN.search(line))
+
+
+def _is_title(line: str) -> bool:
+    """A product title candidate: wordy, not a price, not order boilerplate."""
+    return (
+        sum(c.isalpha() for c in line) >= 8
+        and not _is_label_row(line)
+        and not QUANTITY_PATTERN.fullmatch(line)
+    )
+
+
+def _extract_order_items(lines: List[str]) -> List[str]:
+    """
+    Find the order item section and return one compact line per product:
+    "<title> | Menge: <n> | <price>". Subtotals, shipping and tax lines are
+    skipped. Returns an empty list if no priced items are recognized.
+    """
+    items = []
+    title = None
+    quantity = None
+
+    for line in lines:
+        quantity_match = QUANTITY_PATTERN.search(line)
+        if quantity_match:
+            quantity = quantity_match.group(1)
+
+        price_match = PRICE_PATTERN.search(line)
+        if not price_match:
+            if _is_title(line) and not quantity_match:
+                title = line
+            continue
+
+        # Title and price in the same cell/line
+        rest = (line[:price_match.start()] + line[price_match.end():]).strip(' :-|')
+        if _is_title(rest) and not quantity_match:
+            title = rest
+        elif _is_label_row(line):
+            title = None
+            quantity = None
+            continue
+
+        if title:
+            item = title[:120]
+            if quantity:
+                item += f" | Menge: {quantity}"
+            item += f" | {price_match.group(0)}"
+            items.append(item)
+        title = None
+        quantity = None
+
+    return items
+
+
 def _extract_body(msg: email.message.Message) -> Optional[str]:
     """
     Walk a multipart email and extract the most useful body part.
     Priority: text/plain > text/html
+
+    Only the ordered products (title, quantity, price) are returned when
+    they can be recognized, otherwise the compacted text.
     """
     text_plain = None
     text_html = None
@@ -109,18 +290,26 @@ def _extract_body(msg: email.message.Message) -> Optional[str]:
     else:
         payload = msg.get_payload(decode=True)
         if payload:
-            text_plain = payload.decode(
+            text = payload.decode(
                 msg.get_content_charset() or 'utf-8',
                 errors='replace'
             )
+            if msg.get_content_type() == 'text/html':
+                text_html = text
+            else:
+                text_plain = text
 
     # Return best available representation
     if text_plain:
-        # Truncate to 4000 chars to stay within Claude's practical context
-        return text_plain[:4000]
-    if text_html:
-        # Strip HTML tags to reduce token noise
-        clean = re.sub(r'<[^>]+>', ' ', text_html)
-        clean = re.sub(r'\s+', ' ', clean).strip()
-        return clean[:4000]
-    return None
+        lines = [' '.join(line.split()) for line in text_plain.splitlines()]
+        lines = [line for line in lines if line]
+    elif text_html:
+        lines = _html_to_lines(text_html)
+    else:
+        return None
+
+    items = _extract_order_items(lines)
+    if items:
+        return '\n'.join(items)
+    # Truncate to stay within Claude's practical context
+    return ' '.join(lines)[:MAX_BODY_CHARS]
@@ -0,0 +1,20 @@
+from base.prometheus import counter, histogram, render, timed  # noqa: F401 (re-exported)
+
+REQUESTS = counter(
+    'amazon_categorize_requests_total', 'Categorize requests by endpoint and HTTP status', ['endpoint', 'status'])
+REQUEST_SECONDS = histogram(
+    'amazon_categorize_request_duration_seconds', 'Categorize request latency', ['endpoint'])
+RESULTS = counter(
+    'amazon_categorize_results_total', 'Categorized orders by answering source (local, claude)', ['source'])
+IMAP_SECONDS = histogram(
+    'amazon_imap_duration_seconds', 'IMAP latency by operation (connect, search, fetch)', ['operation'])
+CLAUDE_SECONDS = histogram(
+    'amazon_claude_request_duration_seconds', 'Claude API call latency by HTTP status (error: no response)', ['outcome'])
+CLAUDE_TOKENS = counter(
+    'amazon_claude_tokens_total', 'Claude tokens by type (input, output, cache_read, cache_creation)', ['type'])
+CACHE_REQUESTS = counter(
+    'amazon_cache_requests_total',
+    'Cache lookups by cache (classifier, single_flight) and result (hit, miss)',
+    ['cache', 'result'])
+YNAB_SECONDS = histogram(
+    'amazon_ynab_request_duration_seconds', 'YNAB API call latency', ['operation'])
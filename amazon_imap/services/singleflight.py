@@ -0,0 +1,128 @@
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one computation.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or exception). Results for
+    which `keep` returns True are additionally reused for `ttl` seconds, so
+    a client retrying right after a timeout does not trigger a second run.
+    """
+
+    def __init__(self, ttl: float = 60.0, keep: Optional[Callable] = None):
+        self.ttl = ttl
+        self.keep = keep or (lambda result: True)
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable, timeout: Optional[float] = None):
+        """
+        Run `fn()` once for `key` and return its result.
+
+        Raises TimeoutError if a waiting caller does not get the shared
+        result within `timeout` seconds; the computation keeps running.
+        """
+        with self._lock:
+            self._expire()
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight request {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        finally:
+            call.finished_at = time.monotonic()
+            with self._lock:
+                if call.error is not None or not self.keep(call.result):
+                    self._calls.pop(key, None)
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do_many(self, keys: Iterable[Hashable], fn: Callable, timeout: Optional[float] = None) -> Dict:
+        """
+        Share results per key for a batch of keys.
+
+        Keys already in flight or cached are joined; `fn(keys)` runs once for
+        the remaining ones and must return a dict with a result for each of
+        them. Returns a dict of all keys; a key whose computation raised or
+        whose wait timed out maps to the exception (TimeoutError) instead.
+        """
+        owned: List[Hashable] = []
+        joined: Dict[Hashable, _Call] = {}
+        calls: Dict[Hashable, _Call] = {}
+        with self._lock:
+            self._expire()
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+                    owned.append(key)
+                else:
+                    joined[key] = call
+                calls[key] = call
+
+        if owned:
+            try:
+                results = fn(list(owned))
+            except Exception as e:
+                results, error = {}, e
+            else:
+                error = None
+            for key in owned:
+                call = calls[key]
+                if key in results:
+                    call.result = results[key]
+                else:
+                    call.error = error or LookupError(f"No result for {key}")
+                call.finished_at = time.monotonic()
+                with self._lock:
+                    if call.error is not None or not self.keep(call.result):
+                        self._calls.pop(key, None)
+                call.done.set()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        outcomes = {}
+        for key, call in calls.items():
+            if key in joined:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not call.done.wait(remaining):
+                    outcomes[key] = TimeoutError(f"Timed out waiting for in-flight request {key}")
+                    continue
+            outcomes[key] = call.error if call.error is not None else call.result
+        return outcomes
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            key for key, call in self._calls.items()
+            if call.finished_at is not None and now - call.finished_at > self.ttl
+        ]
+        for key in expired:
+            del self._calls[key]
@@ -1,6 +1,8 @@
 import os
 import requests
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from services.metrics import YNAB_SECONDS, timed
 
 
 YNAB_BASE_URL = "https://api.ynab.com/v1"
@@ -25,7 +27,8 @@ def get_categories() -> List[Dict]:
 
     url = f"{YNAB_BASE_URL}/budgets/{budget_id}/categories"
 
-    response = requests.get(url, headers=headers, timeout=10)
+    with timed(YNAB_SECONDS, operation='get_categories'):
+        response = requests.get(url, headers=headers, timeout=10)
     response.raise_for_status()
 
     data = response.json()
@@ -51,3 +54,34 @@ def get_categories() -> List[Dict]:
             })
 
     return flat_categories
+
+
+def get_transactions(since_date: str, last_knowledge: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """
+    Fetch budget transactions changed since the last call.
+
+    Endpoint: GET /v1/budgets/{budget_id}/transactions
+
+    With `last_knowledge` (the server knowledge returned by the previous
+    call) only transactions changed since then are returned. Returns the
+    transactions and the new server knowledge.
+    """
+    token = os.getenv('YNAB_TOKEN')
+    budget_id = os.getenv('YNAB_BUDGET_ID')
+
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json'
+    }
+
+    url = f"{YNAB_BASE_URL}/budgets/{budget_id}/transactions"
+    params = {'since_date': since_date}
+    if last_knowledge is not None:
+        params['last_knowledge_of_server'] = last_knowledge
+
+    with timed(YNAB_SECONDS, operation='get_transactions'):
+        response = requests.get(url, headers=headers, params=params, timeout=30)
+    response.raise_for_status()
+
+    data = response.json()['data']
+    return data['transactions'], data['server_knowledge']
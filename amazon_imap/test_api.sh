@@ -30,4 +30,20 @@ curl -s -X POST "$API_URL/categorize" \
   -d '{"transaction": "INVALID 123-456-789"}' | jq .
 echo ""
 
+# Test 4: Batch categorization (duplicate order is resolved once)
+echo "4. Test Batch Categorization:"
+curl -s -X POST "$API_URL/categorize/batch" \
+  -H "Content-Type: application/json" \
+  -H "X-API-Secret: $SECRET" \
+  -d '{"transactions": ["AMAZON PAYMENTS 306-6340477-5787538", "AMZN Mktp 306-6340477-5787538", "INVALID 123-456-789"]}' | jq .
+echo ""
+
+# Test 5: Confirm the booked category (teaches the local classifier)
+echo "5. Test Confirmation:"
+curl -s -X POST "$API_URL/categorize/confirm" \
+  -H "Content-Type: application/json" \
+  -H "X-API-Secret: $SECRET" \
+  -d '{"transaction": "AMAZON PAYMENTS 306-6340477-5787538", "category_id": "your-category-uuid"}' | jq .
+echo ""
+
 echo "Done!"
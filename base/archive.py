@@ -0,0 +1,58 @@
+from os import path
+
+import pandas as pd
+
+ARCHIVE_COLUMNS = ['source', 'account', 'import_id', 'date', 'amount', 'payee', 'memo', 'category', 'status']
+
+
+def archive_dir_from_config(config_dict, config_file):
+    """Archive directory configured as `archive_dir` (relative to the config file), or None
+
+    Raises ImportError if an archive is configured but pyarrow is missing, so
+    the import fails before anything is sent instead of silently not archiving.
+    """
+    if not config_dict.get("archive_dir"):
+        return None
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("archive_dir is configured but pyarrow is not installed")
+    return path.join(path.dirname(config_file), config_dict["archive_dir"])
+
+
+def write_archive(rows, archive_dir):
+    """Append normalized transactions to a Parquet dataset partitioned by month
+
+    Every call adds new files below `<archive_dir>/month=YYYY-MM/`, earlier runs
+    are never overwritten. Requires pyarrow.
+
+    Args:
+        rows (list): Dicts with the ARCHIVE_COLUMNS keys
+        archive_dir (str): Root directory of the dataset
+    """
+    if not rows:
+        return
+
+    import pyarrow
+
+    archive = pd.DataFrame(rows, columns=ARCHIVE_COLUMNS)
+    archive['amount'] = archive['amount'].astype(float)
+    archive['month'] = archive['date'].str[:7]
+    # Fixed types: a run without any category would otherwise write a null
+    # column that later cannot be read together with string ones
+    schema = pyarrow.schema([(column, pyarrow.float64() if column == 'amount' else pyarrow.string())
+                             for column in ARCHIVE_COLUMNS + ['month']])
+    archive.to_parquet(archive_dir, engine='pyarrow', partition_cols=['month'], index=False, schema=schema)
+    print(f"Archived {len(archive)} transactions to {archive_dir}", flush=True)
+
+
+def read_archive(archive_dir, columns=None, months=None):
+    """Read the archive, loading only the given columns and months
+
+    Args:
+        archive_dir (str): Root directory of the dataset
+        columns (list): Optional subset of ARCHIVE_COLUMNS to load
+        months (list): Optional list of `YYYY-MM` partitions to load
+    """
+    filters = [('month', 'in', list(months))] if months else None
+    return pd.read_parquet(archive_dir, engine='pyarrow', columns=columns, filters=filters)
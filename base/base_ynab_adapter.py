@@ -1,8 +1,26 @@
 import ynab
 from ynab.rest import ApiException
 import pandas as pd
-from os import path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from base.archive import write_archive
+from base.ledger import get_ledger
+from base.metrics import StageTimer, TRANSACTIONS, TRANSACTIONS_PARSED, YNAB_ERRORS, YNAB_SECONDS, timed
+
+# One YNAB API client per API key and process, so imports reuse its HTTP connections
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+
+def _concat_batches(batches):
+    """One DataFrame of normalized batches, with the normalized columns also when empty"""
+    batches = list(batches)
+    if not batches:
+        return pd.DataFrame(columns=['import_id', 'trans_date', 'amount', 'payee_name', 'memo'])
+    return pd.concat(batches, ignore_index=True)
+
 
 class BaseYNABAdapter:
     """Base YNAB Adapter for handling YNAB connections and transactions
@@ -11,8 +29,14 @@ class BaseYNABAdapter:
         api_key (str): YNAB API KEY
         idfile (str): Path to store processed transaction IDs
         use_csv (bool): Whether to output to CSV instead of directly to YNAB
+        parse_cache (ParseCache): Optional cache of parsed uploads
+        archive_dir (str): Optional Parquet dataset every normalized transaction is appended to
+        progress (callable): Optional callback receiving the `stats` dict while importing
     """
-    def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id = None):
+    SOURCE = None
+
+    def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id = None, parse_cache=None,
+                 archive_dir=None, progress=None):
         if not api_key:
             raise ValueError("YNAB API key must be provided")
             
@@ -24,14 +48,26 @@ class BaseYNABAdapter:
         self.budget_id = budget_id
         self.tempfile = idfile
         self.use_csv = use_csv
-        self.ids_imported = ""
+        self.parse_cache = parse_cache
+        self.failed_imports = 0
+        self.archive_dir = archive_dir
+        self.archive_rows = []
+        self.progress = progress
+        self.stats = dict.fromkeys(['parsed', 'sent', 'skipped', 'conflict', 'failed', 'csv'], 0)
+        self._last_progress = 0
+        self._local = threading.local()
         self.intermediate_df = pd.DataFrame(columns=['import_id', 'date', 'cleared', 'amount', 'payee', 'memo'])
         
-        # Read existing transaction IDs
-        if path.isfile(idfile):
-            self.tempfile = idfile
-            with open(self.tempfile, "r") as file_object:
-                self.ids_imported = file_object.read()
+        # Existing transaction IDs, indexed once per process and shared between adapters
+        self.ids_imported = get_ledger(idfile)
+
+    def _api_client(self):
+        """YNAB API client shared by all adapters using the same API key"""
+        api_key = self.configuration.api_key['Authorization']
+        with _api_clients_lock:
+            if api_key not in _api_clients:
+                _api_clients[api_key] = ynab.ApiClient(self.configuration)
+            return _api_clients[api_key]
 
     def _create_transaction(self, amount, memo, payee_name, trans_date, account_id, api_instance, import_id,
                           cleared='cleared', category_id=None):
@@ -51,6 +87,7 @@ class BaseYNABAdapter:
         account_id = self.account_id or account_id
         if not account_id:
             raise ValueError("account_id must be provided")
+        status = 'failed'
         try:
             if not self.use_csv:
                 transaction_dict = {
@@ -92,34 +129,249 @@ class BaseYNABAdapter:
                 import_id = f"{timestamp}_{import_id}"
                 already_sent = False
             else:
-                already_sent = import_id in self.ids_imported if self.ids_imported else False
+                already_sent = import_id in self.ids_imported
 
             if not already_sent:
                 if self.use_csv:
                     print("Transaction saved to CSV", transaction)
                     self.intermediate_df = self.intermediate_df.append(transaction, ignore_index=True)
+                    status = 'csv'
                 else:
                     print("Sending transaction to API - " + import_id, flush= True)
-                    print(api_instance.create_transaction(self.budget_id, transaction), flush=True)
+                    with timed(YNAB_SECONDS, operation='create_transaction'):
+                        response = api_instance.create_transaction(self.budget_id, transaction)
+                    print(response, flush=True)
+                    status = 'sent'
                     
                 # Record imported transaction
-                with open(self.tempfile, "a") as file_object:
-                    file_object.write(import_id + "\n")
+                self.ids_imported.add(import_id)
                 print(f"✓ Recorded import_id to ids.txt: {import_id}", flush=True)
             else:
+                status = 'skipped'
                 print(f"Skipping already imported transaction: {import_id}", flush=True)
                 
         except ApiException as e:
+            YNAB_ERRORS.labels(status=str(getattr(e, 'status', None) or 'unknown')).inc()
             # Auto-record import_ids that have conflict errors (409) - but NOT debug transactions (we want to keep retrying those)
             if hasattr(e, 'status') and e.status == 409 and not skip_dedup:
                 print(f"Conflict detected for import_id: {original_import_id}. Recording to ids.txt", flush=True)
-                with open(self.tempfile, "a") as file_object:
-                    file_object.write(original_import_id + "\n")
+                self.ids_imported.add(original_import_id)
+                status = 'conflict'
+            else:
+                self.failed_imports += 1
             print(f'Exception when creating transaction: {e}')
 
+        self.stats['parsed'] += 1
+        self.stats[status] += 1
+        TRANSACTIONS_PARSED.labels(source=self.SOURCE).inc()
+        TRANSACTIONS.labels(source=self.SOURCE, status=status).inc()
+        self._report_progress()
+
+        if self.archive_dir:
+            self.archive_rows.append({
+                'source': self.SOURCE,
+                'account': account_id,
+                'import_id': import_id,
+                'date': trans_date,
+                'amount': amount,
+                'payee': payee_name,
+                'memo': memo,
+                'category': category_id,
+                'status': status
+            })
+
+    def _create_transactions(self, transactions, api_instance, cleared='cleared'):
+        """Create a normalized batch of transactions in YNAB
+
+        Args:
+            transactions (pd.DataFrame): One row per transaction with the columns
+                `import_id`, `trans_date`, `amount`, `payee_name`, `memo` and
+                optionally `category_id`
+            api_instance: YNAB API instance
+            cleared (str): Transaction cleared status
+        """
+        has_category = 'category_id' in transactions.columns
+        for transaction in transactions.to_dict('records'):
+            self._create_transaction(
+                amount=transaction['amount'],
+                memo=transaction['memo'],
+                payee_name=transaction['payee_name'],
+                trans_date=transaction['trans_date'],
+                account_id=self.account_id,
+                api_instance=api_instance,
+                import_id=transaction['import_id'],
+                cleared=cleared,
+                category_id=transaction['category_id'] if has_category else None
+            )
+
+    def _with_occurrences(self, import_ids):
+        """Make repeated import IDs within one upload unique
+
+        Identical transactions (e.g. two equal purchases on the same day) hash
+        to the same import ID. The first occurrence keeps the plain ID, so
+        earlier imports stay deduplicated; the n-th repeat gets a `.n` suffix.
+        Counting follows the order of the upload and continues across batches
+        of the same upload, so re-importing the file yields the same IDs.
+
+        Args:
+            import_ids (iterable): Hash based import IDs in upload order
+
+        Returns:
+            list: Occurrence-aware import IDs
+        """
+        result = []
+        for import_id in import_ids:
+            occurrence = self._occurrences.get(import_id, 0) + 1
+            self._occurrences[import_id] = occurrence
+            result.append(import_id if occurrence == 1 else f"{import_id}.{occurrence}")
+        return result
+
+    @property
+    def _occurrences(self):
+        """Occurrence counts of the upload parsed by the current thread"""
+        if not hasattr(self._local, 'occurrences'):
+            self._local.occurrences = {}
+        return self._local.occurrences
+
+    @_occurrences.setter
+    def _occurrences(self, value):
+        self._local.occurrences = value
+
+    def _parse_options(self):
+        """Settings of this adapter the parsed transactions depend on, part of the parse cache key"""
+        return {}
+
+    def _import_batches(self, source, upload, from_date, batches, api_instance):
+        """Send normalized batches of an uploaded file, using the parse cache
+
+        Without a parse cache every batch from `batches()` is sent. With a
+        cache, a fully imported identical upload returns immediately and a
+        previously parsed one is sent from the cache without parsing again.
+
+        Args:
+            source (str): Source name, part of the cache key
+            upload: Uploaded file as path, bytes or binary file object
+            from_date (str): Start date the batches were filtered with
+            batches (callable): Returns an iterable of normalized DataFrames
+            api_instance: YNAB API instance
+        """
+        self._occurrences = {}
+        timer = StageTimer(source)
+        try:
+            self._import_timed_batches(source, upload, from_date, batches, api_instance, timer)
+        finally:
+            timer.observe()
+
+    def _import_timed_batches(self, source, upload, from_date, batches, api_instance, timer):
+        """`_import_batches` recording the parse and send time in `timer`"""
+        if not self.parse_cache:
+            for batch in timer.iterate('parse', batches()):
+                with timer.stage('send'):
+                    self._create_transactions(batch, api_instance)
+            return
+
+        key = self.parse_cache.key(source, upload, self.account_id, from_date, self._parse_options())
+        entry = self.parse_cache.get(key)
+        self.failed_imports = 0
+
+        if entry and entry['imported'] and not self.use_csv:
+            print(f"Upload already fully imported, skipping ({source} {key[:12]})", flush=True)
+            return
+
+        if entry:
+            print(f"Using cached parse result ({source} {key[:12]})", flush=True)
+            for batch in self.parse_cache.batches(key):
+                with timer.stage('send'):
+                    self._create_transactions(batch, api_instance)
+        else:
+            # Each batch is written to the cache as it is sent, never collected in memory
+            with self.parse_cache.writer(key) as write:
+                for batch in timer.iterate('parse', batches()):
+                    with timer.stage('send'):
+                        self._create_transactions(batch, api_instance)
+                    write(batch)
+
+        self.parse_cache.mark_imported(key, not self.failed_imports and not self.use_csv)
+
+    def _import_uploads(self, source, uploads, from_date, batches, api_instance, workers=4):
+        """Parse several uploads in parallel and send them as one deduplicated batch
+
+        Each upload is parsed on its own thread (or taken from the parse cache)
+        with its own occurrence counting, so its import IDs match a separate
+        import of the same file. The results are merged in upload order,
+        transactions contained in several uploads (e.g. overlapping
+        statements) are kept once, and everything is sent in one pass.
+
+        Args:
+            source (str): Source name, part of the cache key
+            uploads (list): Uploaded files as paths, bytes or binary file objects
+            from_date (str): Start date the batches were filtered with
+            batches (callable): Takes an upload, returns an iterable of normalized DataFrames
+            api_instance: YNAB API instance
+            workers (int): Number of uploads parsed at once
+        """
+        if len(uploads) == 1:
+            self._import_batches(source, uploads[0], from_date, lambda: batches(uploads[0]), api_instance)
+            return
+
+        def parse(upload):
+            self._occurrences = {}
+            key = None
+            if self.parse_cache:
+                key = self.parse_cache.key(source, upload, self.account_id, from_date, self._parse_options())
+                entry = self.parse_cache.get(key)
+                if entry and entry['imported'] and not self.use_csv:
+                    print(f"Upload already fully imported, skipping ({source} {key[:12]})", flush=True)
+                    return key, None
+                if entry:
+                    print(f"Using cached parse result ({source} {key[:12]})", flush=True)
+                    return key, _concat_batches(self.parse_cache.batches(key))
+            return key, _concat_batches(batches(upload))
+
+        timer = StageTimer(source)
+        try:
+            with timer.stage('parse'):
+                with ThreadPoolExecutor(max_workers=max(1, min(workers, len(uploads)))) as executor:
+                    results = list(executor.map(parse, uploads))
+
+            parsed = [transactions for _, transactions in results if transactions is not None]
+            if parsed:
+                merged = pd.concat(parsed, ignore_index=True)
+                unique = merged.drop_duplicates(subset='import_id', keep='first')
+                print(f"Merged {len(uploads)} uploads: {len(unique)} transactions, "
+                      f"{len(merged) - len(unique)} duplicates across files dropped", flush=True)
+                self.failed_imports = 0
+                with timer.stage('send'):
+                    self._create_transactions(unique, api_instance)
+        finally:
+            timer.observe()
+
+        for key, transactions in results:
+            if key and transactions is not None:
+                self.parse_cache.put(key, transactions, imported=not self.failed_imports and not self.use_csv)
+
+    def _report_progress(self, final=False):
+        """Pass the current stats to the progress callback, at most once per second"""
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if final or now - self._last_progress >= 1:
+            self._last_progress = now
+            self.progress(dict(self.stats))
+
+    def _write_archive(self):
+        """Append the transactions of this import to the Parquet archive
+
+        Called once at the end of every import, also reports the final stats.
+        """
+        self._report_progress(final=True)
+        if self.archive_dir and self.archive_rows:
+            write_archive(self.archive_rows, self.archive_dir)
+        self.archive_rows = []
+
     def get_budgets(self):
         """Get available YNAB budgets"""
-        api_instance = ynab.BudgetsApi(ynab.ApiClient(self.configuration))
+        api_instance = ynab.BudgetsApi(self._api_client())
         try:
             api_response = api_instance.get_budgets()
             for budget in api_response.to_dict()['data']['budgets']:
@@ -132,7 +384,7 @@ class BaseYNABAdapter:
         if not self.budget_id:
             raise ValueError("Budget ID must be set before getting accounts")
             
-        api_instance = ynab.AccountsApi(ynab.ApiClient(self.configuration))
+        api_instance = ynab.AccountsApi(self._api_client())
         try:
             api_response = api_instance.get_accounts(self.budget_id)
             for account in api_response.to_dict()['data']['accounts']:
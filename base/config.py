@@ -0,0 +1,31 @@
+import json
+import os
+import threading
+
+from base.metrics import CACHE_REQUESTS
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+def load_config(config_file):
+    """Parsed config JSON, re-read only when the file's mtime changes
+
+    The returned dict is shared within the process and must not be modified.
+    """
+    if not os.path.exists(config_file):
+        raise FileNotFoundError("Config file not found")
+
+    mtime = os.stat(config_file).st_mtime_ns
+    with _configs_lock:
+        cached = _configs.get(config_file)
+        if cached and cached[0] == mtime:
+            CACHE_REQUESTS.labels(cache='config', result='hit').inc()
+            return cached[1]
+    CACHE_REQUESTS.labels(cache='config', result='miss').inc()
+
+    with open(config_file, "r") as whole_config:
+        config_dict = json.load(whole_config)
+    with _configs_lock:
+        _configs[config_file] = (mtime, config_dict)
+    return config_dict
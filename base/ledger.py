@@ -0,0 +1,77 @@
+import os
+import threading
+from os import path
+
+from base.locking import locked
+
+
+class Ledger:
+    """In-memory index of the import IDs recorded in an id file
+
+    The id file is append-only, one import ID per line. The index is loaded
+    once and kept warm; `refresh` only reads what other processes appended
+    since the last look and reloads fully if the file was replaced or
+    truncated. Writers in other processes hold an exclusive file lock, so
+    reads never see half-written lines.
+
+    Args:
+        id_file (str): Path of the id file
+    """
+    def __init__(self, id_file):
+        self.id_file = id_file
+        self.ids = set()
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._identity = None
+        self.refresh()
+
+    def _read_from(self, offset):
+        with open(self.id_file, "r") as file_object, locked(file_object, shared=True):
+            file_object.seek(offset)
+            self.ids.update(line.strip() for line in file_object if line.strip())
+            self._offset = file_object.tell()
+
+    def refresh(self):
+        """Pick up IDs written to the id file since the last refresh"""
+        with self._lock:
+            try:
+                stat = os.stat(self.id_file)
+            except FileNotFoundError:
+                return
+            identity = (stat.st_dev, stat.st_ino)
+            if identity != self._identity or stat.st_size < self._offset:
+                self.ids = set()
+                self._offset = 0
+                self._identity = identity
+            if stat.st_size > self._offset:
+                self._read_from(self._offset)
+
+    def add(self, import_id):
+        """Record an import ID in the index and the id file"""
+        with self._lock:
+            with open(self.id_file, "a") as file_object, locked(file_object):
+                file_object.write(import_id + "\n")
+                file_object.flush()
+            self.ids.add(import_id)
+
+    def __contains__(self, import_id):
+        return import_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(id_file):
+    """Shared Ledger of an id file for this process, refreshed before use"""
+    key = path.abspath(id_file)
+    with _ledgers_lock:
+        ledger = _ledgers.get(key)
+        if ledger is None:
+            ledger = _ledgers[key] = Ledger(id_file)
+            return ledger
+    ledger.refresh()
+    return ledger
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows development setup runs a single process
+    fcntl = None
+
+
+@contextmanager
+def locked(file_object, shared=False):
+    """Hold an advisory lock on an open file, shared for readers or exclusive for writers"""
+    if fcntl:
+        fcntl.flock(file_object.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    try:
+        yield file_object
+    finally:
+        if fcntl:
+            fcntl.flock(file_object.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive lock across processes, held on a separate lock file"""
+    with open(lock_path, "a") as lock_file, locked(lock_file):
+        yield
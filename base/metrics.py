@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager
+
+from base.prometheus import counter, histogram, render, timed  # noqa: F401 (re-exported)
+
+IMPORT_REQUESTS = counter(
+    'ynab_import_requests_total', 'Import requests by source and outcome (accepted, existing or the HTTP status)',
+    ['source', 'outcome'])
+IMPORT_JOBS = counter(
+    'ynab_import_jobs_total', 'Finished import jobs by source and status', ['source', 'status'])
+STAGE_SECONDS = histogram(
+    'ynab_import_stage_duration_seconds', 'Import latency by source and stage (queue, job, parse, send)',
+    ['source', 'stage'])
+TRANSACTIONS_PARSED = counter(
+    'ynab_transactions_parsed_total', 'Transactions parsed from uploads or fetched from the bank', ['source'])
+TRANSACTIONS = counter(
+    'ynab_transactions_total', 'Parsed transactions by source and status (sent, skipped, conflict, failed)',
+    ['source', 'status'])
+YNAB_SECONDS = histogram(
+    'ynab_api_request_duration_seconds', 'YNAB API call latency', ['operation'])
+YNAB_ERRORS = counter(
+    'ynab_api_errors_total', 'Failed YNAB API calls by HTTP status (429: rate limited)', ['status'])
+COMDIRECT_SECONDS = histogram(
+    'comdirect_request_duration_seconds', 'Comdirect API latency by endpoint', ['endpoint'])
+CACHE_REQUESTS = counter(
+    'ynab_cache_requests_total', 'Cache lookups by cache (parse, config) and result (hit, miss)',
+    ['cache', 'result'])
+
+
+class StageTimer:
+    """Adds up the time one import spends per stage, observed once at the end
+
+    Parsing and sending interleave when batches are streamed, so each stage
+    is summed over all of its slices.
+
+    Args:
+        source (str): Source name of the import
+    """
+    def __init__(self, source):
+        self.source = source
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start
+
+    def iterate(self, name, iterable):
+        """Yield from `iterable`, counting the time spent producing items as stage `name`"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def observe(self):
+        for name, seconds in self.seconds.items():
+            STAGE_SECONDS.labels(source=self.source, stage=name).observe(seconds)
+        self.seconds = {}
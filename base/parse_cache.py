@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from os import path
+
+from base.metrics import CACHE_REQUESTS
+from base.upload import upload_digest
+
+
+class ParseCache:
+    """Cache of parsed uploads keyed by their content hash
+
+    Each entry stores the normalized transaction batches of an upload and
+    whether it was fully imported, so identical re-uploads skip parsing or
+    return immediately. Batches are written and read one at a time, so a
+    streamed import never holds the whole upload in memory for the cache.
+    Entries older than `max_age` seconds are dropped and the oldest entries
+    are evicted once the cache exceeds `max_bytes`.
+
+    Args:
+        directory (str): Directory holding one pickle file per entry, plus an
+            `.imported` marker file for fully imported uploads
+        max_age (int): Maximum entry age in seconds
+        max_bytes (int): Maximum total size of all entries in bytes
+    """
+    def __init__(self, directory, max_age=7 * 24 * 3600, max_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def file_digest(upload):
+        """SHA-256 of an upload's content (path, bytes or file object)"""
+        return upload_digest(upload)
+
+    def key(self, source, upload, account_id=None, from_date=None, options=None):
+        """Cache key for an upload of a source into an account since from_date
+
+        Args:
+            options (dict): Settings the parse result depends on (column
+                mapping, separator, filters, ...), so changing them parses again
+        """
+        options_json = json.dumps(options or {}, sort_keys=True, default=str)
+        options_digest = hashlib.sha256(options_json.encode()).hexdigest()
+        return hashlib.sha256(
+            f"{source}|{account_id}|{from_date}|{options_digest}|{self.file_digest(upload)}".encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+
+    def _entry_path(self, key):
+        return path.join(self.directory, key + '.pkl')
+
+    def _marker_path(self, key):
+        return path.join(self.directory, key + '.imported')
+
+    def _discard(self, key):
+        self._remove(self._entry_path(key))
+        self._remove(self._marker_path(key))
+
+    def get(self, key):
+        """Return the entry dict (`imported`, `created`) or None
+
+        The transactions of an entry are read with `batches`.
+        """
+        entry = self._lookup(key)
+        CACHE_REQUESTS.labels(cache='parse', result='miss' if entry is None else 'hit').inc()
+        return entry
+
+    def _lookup(self, key):
+        entry_path = self._entry_path(key)
+        if not path.isfile(entry_path):
+            return None
+        created = path.getmtime(entry_path)
+        if time.time() - created > self.max_age:
+            self._discard(key)
+            return None
+        return {'imported': path.exists(self._marker_path(key)), 'created': created}
+
+    def batches(self, key):
+        """Yield the stored transaction batches of an entry one at a time
+
+        A damaged entry is removed; batches read before the damage was found
+        have already been yielded.
+        """
+        try:
+            with open(self._entry_path(key), 'rb') as file_object:
+                while True:
+                    try:
+                        yield pickle.load(file_object)
+                    except EOFError:
+                        return
+        except (FileNotFoundError, pickle.UnpicklingError):
+            self._discard(key)
+
+    @contextmanager
+    def writer(self, key):
+        """Store an entry batch by batch: `with cache.writer(key) as write: write(batch)`
+
+        The entry appears once the block completes, an exception discards it.
+        Existing entries of the key are replaced, evicting old entries afterwards.
+        """
+        entry_path = self._entry_path(key)
+        # Unique per writer, several server workers may store the same upload at once
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file_object:
+                yield lambda batch: pickle.dump(batch, file_object)
+            self._remove(self._marker_path(key))
+            os.replace(tmp_path, entry_path)
+        finally:
+            self._remove(tmp_path)
+        self.evict()
+
+    def mark_imported(self, key, imported=True):
+        """Record whether all transactions of an entry were imported"""
+        if imported:
+            open(self._marker_path(key), 'w').close()
+        else:
+            self._remove(self._marker_path(key))
+
+    def put(self, key, transactions, imported=False):
+        """Store the normalized transactions of an upload as one batch and evict old entries"""
+        with self.writer(key) as write:
+            write(transactions)
+        self.mark_imported(key, imported)
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones until under max_bytes"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            key = name[:-len('.pkl')]
+            try:
+                stat = os.stat(path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._discard(key)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._discard(key)
+            total -= size
+
+
+def parse_cache_from_config(config_dict, config_file):
+    """Build the ParseCache configured in a config JSON, or None if disabled
+
+    Keys: `parse_cache` (bool, default true), `parse_cache_dir` (relative to the
+    config file, default `parse_cache`), `parse_cache_max_age_days` (default 7)
+    and `parse_cache_max_mb` (default 200).
+    """
+    if not config_dict.get("parse_cache", True):
+        return None
+    return ParseCache(
+        directory=path.join(path.dirname(config_file), config_dict.get("parse_cache_dir", "parse_cache")),
+        max_age=int(config_dict.get("parse_cache_max_age_days", 7) * 24 * 3600),
+        max_bytes=int(config_dict.get("parse_cache_max_mb", 200) * 1024 * 1024)
+    )
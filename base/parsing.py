@@ -0,0 +1,96 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# German amount such as "1.234,56" or "-12,50" inside free text
+GERMAN_AMOUNT_PATTERN = re.compile(r'-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d{2}')
+
+_CURRENCY_PATTERN = r'[€$\s]|EUR|USD'
+_THOUSANDS_ONLY_PATTERN = r'^[+-]?\d{1,3}(?:\.\d{3})+$'
+
+
+def parse_amounts(values, locale='de'):
+    """Parse a column of amounts into floats
+
+    Args:
+        values (pd.Series): Raw amounts, as strings or already numeric
+        locale (str): `de` for "1.234,56" or `en` for "1,234.56"
+
+    In `de` mode a dot without a decimal comma is only treated as thousands
+    separator for "1.234"-style groups, so "12.50" still parses as 12.5.
+    Trailing minus signs ("12,50-") are moved to the front.
+
+    Returns:
+        pd.Series: float amounts with the same index
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+
+    text = values.astype(object).where(values.notna(), '').astype(str) \
+        .str.replace(_CURRENCY_PATTERN, '', regex=True)
+    trailing_minus = text.str.endswith('-')
+    text = text.str.rstrip('-').where(~trailing_minus, '-' + text.str.rstrip('-'))
+
+    if locale == 'de':
+        has_comma = text.str.contains(',', regex=False)
+        thousands_only = text.str.match(_THOUSANDS_ONLY_PATTERN)
+        without_dots = text.str.replace('.', '', regex=False)
+        text = pd.Series(np.where(
+            has_comma, without_dots.str.replace(',', '.', regex=False),
+            np.where(thousands_only, without_dots, text)
+        ), index=values.index)
+    else:
+        text = text.str.replace(',', '', regex=False)
+
+    return pd.to_numeric(text.replace('', np.nan), errors='raise').astype(float)
+
+
+def parse_amount(value, locale='de'):
+    """Parse a single amount with the same rules as parse_amounts"""
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = re.sub(_CURRENCY_PATTERN, '', str(value))
+    if text.endswith('-'):
+        text = '-' + text.rstrip('-')
+
+    if locale == 'de':
+        if ',' in text:
+            text = text.replace('.', '').replace(',', '.')
+        elif re.match(_THOUSANDS_ONLY_PATTERN, text):
+            text = text.replace('.', '')
+    else:
+        text = text.replace(',', '')
+    return float(text)
+
+
+def parse_dates(values, fmt='%d.%m.%Y', cache=True):
+    """Parse a column of dates into ISO strings (YYYY-MM-DD)
+
+    Args:
+        values (pd.Series): Raw date strings
+        fmt (str): strptime format of the raw dates
+        cache (bool): Parse each distinct date string only once
+
+    Returns:
+        pd.Series: ISO date strings with the same index
+    """
+    return pd.to_datetime(values, format=fmt, cache=cache).dt.strftime('%Y-%m-%d')
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_cached(value, fmt):
+    return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+
+
+def parse_date(value, fmt='%d.%m.%Y', cache=True):
+    """Parse a single date string into an ISO string (YYYY-MM-DD)
+
+    Repeated date strings are served from an LRU cache unless `cache` is False.
+    """
+    if cache:
+        return _parse_date_cached(value, fmt)
+    return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
@@ -0,0 +1,67 @@
+"""Prometheus helpers shared by the import server and the Amazon categorizer
+
+Only needs the standard library; the categorizer image copies this module
+without the rest of `base`. Without prometheus_client every metric is a no-op.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# API, IMAP and Claude calls take milliseconds, whole imports of large statements minutes
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _NoopMetric:
+    """Stands in for every metric when prometheus_client is not installed"""
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def counter(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+def histogram(name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block in `histogram`, also when it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def render():
+    """Metrics in the Prometheus text format, as (body, content type)
+
+    With PROMETHEUS_MULTIPROC_DIR set (several gunicorn workers) the values
+    of all worker processes are aggregated.
+    """
+    if prometheus_client is None:
+        return b'# prometheus_client is not installed\n', 'text/plain; charset=utf-8'
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+# Uploads up to this size stay in memory, larger ones are spilled to a temp file
+SPILL_THRESHOLD = 10 * 1024 * 1024
+# Decompressed uploads and archive contents may expand to at most this size
+MAX_EXPANDED_SIZE = 200 * 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Content-Encoding values of the supported codecs
+CODECS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+
+
+def is_path(upload):
+    return isinstance(upload, (str, os.PathLike))
+
+
+def upload_missing(upload):
+    """True if a path upload does not exist or an in-memory upload is empty"""
+    if upload is None:
+        return True
+    if isinstance(upload, (list, tuple)):
+        return not upload or any(upload_missing(item) for item in upload)
+    if is_path(upload):
+        return not os.path.exists(upload)
+    if isinstance(upload, (bytes, bytearray, memoryview)):
+        return len(upload) == 0
+    return False
+
+
+@contextmanager
+def open_upload(upload):
+    """Open an upload for binary reading, positioned at its start
+
+    Args:
+        upload: File path, bytes buffer, seekable binary file object or
+            CompressedUpload. Compressed uploads yield a forward-only stream.
+    """
+    if is_path(upload):
+        with open(upload, 'rb') as file_object:
+            yield file_object
+    elif isinstance(upload, CompressedUpload):
+        with upload.open() as stream:
+            yield stream
+    elif isinstance(upload, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(upload)
+    else:
+        upload.seek(0)
+        yield upload
+
+
+def read_upload(upload):
+    """Return the content of an in-memory upload as bytes, without copying bytes buffers"""
+    if isinstance(upload, bytes):
+        return upload
+    with open_upload(upload) as file_object:
+        return file_object.read()
+
+
+def upload_digest(upload, raw=False, block_size=1024 * 1024):
+    """SHA-256 of an upload's content
+
+    With `raw` a compressed upload is hashed as received, without decompressing it.
+    """
+    if raw and isinstance(upload, CompressedUpload):
+        upload = upload.upload
+    digest = hashlib.sha256()
+    with open_upload(upload) as file_object:
+        for block in iter(lambda: file_object.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def spool_upload(stream, threshold=SPILL_THRESHOLD):
+    """Take over an uploaded stream: bytes if small, else the path of a temp file
+
+    Only uploads larger than `threshold` are written to disk. The caller owns
+    the returned temp file and removes it with `discard_upload`.
+    """
+    head = stream.read(threshold + 1)
+    if len(head) <= threshold:
+        return head
+
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_file.write(head)
+        shutil.copyfileobj(stream, temp_file)
+    return temp_file.name
+
+
+def discard_upload(upload):
+    """Remove the temp file of a spilled upload, in-memory uploads need no cleanup"""
+    if isinstance(upload, CompressedUpload):
+        upload = upload.upload
+    if is_path(upload) and os.path.exists(upload):
+        os.unlink(upload)
+
+
+def _too_large(max_size):
+    return ValueError(f"Upload expands to more than {max_size / (1024 * 1024):g} MB")
+
+
+class _LimitedStream(io.RawIOBase):
+    """Forward-only reader failing once more than `limit` bytes were read"""
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        self.count += len(data)
+        if self.count > self.limit:
+            raise _too_large(self.limit)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class CompressedUpload:
+    """Upload stored compressed and decompressed while it is read
+
+    Every `open_upload` starts a new decompressing stream, so the expanded
+    content never exists as a whole on disk or, for CSV parsers, in memory.
+    Reading more than `max_size` decompressed bytes raises ValueError.
+
+    Args:
+        upload: The compressed upload (path, bytes or binary file object)
+        codec (str): `gzip` or `zstd`
+        max_size (int): Maximum decompressed size in bytes
+    """
+    def __init__(self, upload, codec, max_size=MAX_EXPANDED_SIZE):
+        self.upload = upload
+        self.codec = codec
+        self.max_size = max_size
+
+    @contextmanager
+    def open(self):
+        with open_upload(self.upload) as raw:
+            if self.codec == 'gzip':
+                with gzip.GzipFile(fileobj=raw) as stream:
+                    yield io.BufferedReader(_LimitedStream(stream, self.max_size))
+            else:
+                try:
+                    import zstandard
+                except ImportError:
+                    raise ValueError("zstd compressed uploads require the zstandard package")
+                with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                    yield io.BufferedReader(_LimitedStream(stream, self.max_size))
+
+
+def decompress_upload(upload, encoding=None, max_size=MAX_EXPANDED_SIZE):
+    """Wrap a gzip or zstd compressed upload, other uploads are returned as they are
+
+    Args:
+        upload: Uploaded file as path, bytes or binary file object
+        encoding (str): Content-Encoding sent with the upload; without it the
+            codec is detected from the magic bytes
+        max_size (int): Maximum decompressed size in bytes
+    """
+    codec = CODECS.get((encoding or '').strip().lower())
+    if not codec:
+        with open_upload(upload) as file_object:
+            head = file_object.read(4)
+        if head.startswith(GZIP_MAGIC):
+            codec = 'gzip'
+        elif head == ZSTD_MAGIC:
+            codec = 'zstd'
+    return CompressedUpload(upload, codec, max_size) if codec else upload
+
+
+def _skipped_member(name):
+    """Directories, hidden files and macOS resource forks inside archives"""
+    base_name = os.path.basename(name.rstrip('/'))
+    return name.endswith('/') or base_name.startswith('.') or '__MACOSX/' in name
+
+
+def _expand_zip(upload, threshold, max_size, members):
+    """Spool the members of a ZIP upload into `members`, False if it is no ZIP"""
+    spooled = None
+    try:
+        with open_upload(upload) as file_object:
+            if not file_object.seekable():
+                # ZIP needs random access, a decompressing stream is spooled first
+                spooled = spool_upload(file_object, threshold)
+        source = spooled if spooled is not None else upload
+        with open_upload(source) as file_object:
+            if not zipfile.is_zipfile(file_object):
+                return False
+            with zipfile.ZipFile(file_object) as archive:
+                infos = [info for info in archive.infolist()
+                         if not info.is_dir() and not _skipped_member(info.filename)]
+                if sum(info.file_size for info in infos) > max_size:
+                    raise _too_large(max_size)
+                for info in infos:
+                    with archive.open(info) as member:
+                        members.append(spool_upload(member, threshold))
+        return True
+    finally:
+        if spooled is not None:
+            discard_upload(spooled)
+
+
+def expand_archives(uploads, threshold=SPILL_THRESHOLD, max_size=MAX_EXPANDED_SIZE):
+    """Replace ZIP and tar uploads by their member files, in archive order
+
+    Archives are recognized by their content, not their file name, also
+    inside a compressed upload (e.g. .tar.gz). Members are spooled like
+    uploads: kept in memory up to `threshold`, else written to temp files the
+    caller removes with `discard_upload`. An archive whose members add up to
+    more than `max_size` bytes raises ValueError.
+    """
+    members = []
+    try:
+        for upload in uploads:
+            with open_upload(upload) as file_object:
+                head = file_object.read(262)
+            if head.startswith(b'PK\x03\x04'):
+                if _expand_zip(upload, threshold, max_size, members):
+                    continue
+            elif head[257:262] == b'ustar':
+                # Stream mode reads the tar front to back, compressed uploads cannot seek back
+                total = 0
+                with open_upload(upload) as file_object, tarfile.open(fileobj=file_object, mode='r|') as archive:
+                    for info in archive:
+                        if info.isfile() and not _skipped_member(info.name):
+                            total += info.size
+                            if total > max_size:
+                                raise _too_large(max_size)
+                            members.append(spool_upload(archive.extractfile(info), threshold))
+                continue
+            members.append(upload)
+    except Exception:
+        for member in members:
+            if member not in uploads:
+                discard_upload(member)
+        raise
+    return members
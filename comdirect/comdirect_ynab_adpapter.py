@@ -1,6 +1,8 @@
 import re
-from datetime import date, datetime as dt
+from datetime import date
 from base import base_ynab_adapter
+from base.metrics import COMDIRECT_SECONDS, timed
+from base.parsing import parse_amount, parse_date
 import ynab
 import requests
 import os
@@ -13,13 +15,19 @@ class ComdirectYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
         comdir_connector (ComdirectConnector): Connected Comdirect connector
         idfile (str): Path to store processed transaction IDs
         use_csv (bool): Whether to output to CSV instead of directly to YNAB
+        archive_dir (str): Optional Parquet archive directory
+        progress (callable): Optional import progress callback
     """
+    SOURCE = 'comdirect'
+
     def __init__(self, api_key=None, comdir_connector=None, idfile="ids.txt",
-                 use_csv=False, account_id=None, budget_id=None, amazon_csv=None):
+                 use_csv=False, account_id=None, budget_id=None, amazon_csv=None, archive_dir=None,
+                 progress=None):
         if not comdir_connector or type(comdir_connector).__name__ != 'ComdirectConnector':
             raise ValueError('You must provide a ComdirectConnector object')
 
-        super().__init__(api_key=api_key, idfile=idfile, use_csv=use_csv)
+        super().__init__(api_key=api_key, idfile=idfile, use_csv=use_csv, archive_dir=archive_dir,
+                         progress=progress)
 
         self.comdirect_connector = comdir_connector
         self.transactions = None
@@ -55,7 +63,8 @@ class ComdirectYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
             
     def __get_transactions(self, konto_text='Girokonto', iban=None):
         """Get transactions from Comdirect connector"""
-        self.transactions = self.comdirect_connector.get_transactions(konto_text=konto_text, iban=iban)
+        with timed(COMDIRECT_SECONDS, endpoint='transactions'):
+            self.transactions = self.comdirect_connector.get_transactions(konto_text=konto_text, iban=iban)
 
     def create_comdirect_transactions(self, from_date=date.today().strftime('%Y-%m-%d'), konto_text='Girokonto', iban=None, paypal_account_id=None):
         """Create YNAB transactions from Comdirect data
@@ -69,8 +78,10 @@ class ComdirectYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
             paypal_account_id (str): Optional PayPal account ID
         """
 
+        from_date = parse_date(from_date, '%Y-%m-%d')
+
         # Get API instance
-        api_instance = ynab.TransactionsApi(ynab.ApiClient(self.configuration)) if not self.use_csv else None
+        api_instance = ynab.TransactionsApi(self._api_client()) if not self.use_csv else None
         
         # Get account ID if not provided
         if not self.account_id:
@@ -81,12 +92,11 @@ class ComdirectYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
         self.__get_transactions(konto_text=konto_text, iban=iban)
         
         for transaction in self.transactions:
-            if transaction['bookingDate'] and dt.strptime(transaction['bookingDate'], '%Y-%m-%d') >= dt.strptime(
-                    from_date, '%Y-%m-%d'):
+            if transaction['bookingDate'] and parse_date(transaction['bookingDate'], '%Y-%m-%d') >= from_date:
                 # Check date
-                if dt.strptime(transaction['bookingDate'], '%Y-%m-%d') >= dt.strptime(from_date, '%Y-%m-%d'):
+                if parse_date(transaction['bookingDate'], '%Y-%m-%d') >= from_date:
                     # Process transaction details
-                    trans_amount = float(transaction['amount']['value'])
+                    trans_amount = parse_amount(transaction['amount']['value'], locale='en')
                     trans_date = transaction['bookingDate']
                     category_id = None
                     
@@ -167,4 +177,6 @@ class ComdirectYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
                     )
 
         if self.use_csv:
-            self.intermediate_df.to_csv("comdirect_ynab_upload.csv", index=False)
\ No newline at end of file
+            self.intermediate_df.to_csv("comdirect_ynab_upload.csv", index=False)
+
+        self._write_archive()
\ No newline at end of file
@@ -4,16 +4,18 @@ import os
 from os import path
 from comdirect import ComdirectConnector
 from comdirect import comdirect_ynab_adpapter
+from base.archive import archive_dir_from_config
+from base.config import load_config
+from base.locking import file_lock
+from base.metrics import COMDIRECT_SECONDS, timed
 
 class YNABComdirectConfig:
-    def __init__(self, config_file=None, start_only=False, validate_only=False):
-        if not path.exists(config_file):
-            raise FileNotFoundError("Config file not found")
-
-        with open(config_file, "r") as whole_config:
-            self.config_dict = json.load(whole_config)
+    def __init__(self, config_file=None, start_only=False, validate_only=False, progress=None):
+        self.config_dict = load_config(config_file)
             
         connector_state_file = path.join(path.dirname(config_file), 'comdirect_state.pkl')
+        # Serializes the login state between server workers
+        state_lock = connector_state_file + '.lock'
 
         if start_only:
             comdirect_up_path = path.join(path.dirname(config_file), self.config_dict["comdirect_u_p"])
@@ -30,28 +32,38 @@ class YNABComdirectConfig:
             secret_class.read_client_id_secret(comdirect_api_path)
             
             comdirect_connector = ComdirectConnector.ComdirectConnector(secrets=secret_class, manual_mode=False)
-            comdirect_connector.oauth_init()
-            comdirect_connector.get_session_status()
-            comdirect_connector.validate_session()
+            with timed(COMDIRECT_SECONDS, endpoint='oauth_init'):
+                comdirect_connector.oauth_init()
+            with timed(COMDIRECT_SECONDS, endpoint='session_status'):
+                comdirect_connector.get_session_status()
+            with timed(COMDIRECT_SECONDS, endpoint='validate_session'):
+                comdirect_connector.validate_session()
             
-            with open(connector_state_file, 'wb') as f:
-                pickle.dump(comdirect_connector, f)
+            with file_lock(state_lock):
+                with open(connector_state_file + '.tmp', 'wb') as f:
+                    pickle.dump(comdirect_connector, f)
+                os.replace(connector_state_file + '.tmp', connector_state_file)
             return
                 
         if validate_only:
-            if not path.exists(connector_state_file):
-                raise FileNotFoundError("No active Comdirect session found")
-            
-            try:
-                with open(connector_state_file, 'rb') as f:
-                    comdirect_connector = pickle.load(f)
-                print("Loaded connector state")
-            except EOFError as e:
-                print(f"Error loading state: {e}")
-                raise
-            
-            comdirect_connector.validate_response()
-            comdirect_connector.oath_secondary()
+            # Only one worker may complete a session; it is removed once the TAN is validated
+            with file_lock(state_lock):
+                if not path.exists(connector_state_file):
+                    raise FileNotFoundError("No active Comdirect session found")
+
+                try:
+                    with open(connector_state_file, 'rb') as f:
+                        comdirect_connector = pickle.load(f)
+                    print("Loaded connector state")
+                except EOFError as e:
+                    print(f"Error loading state: {e}")
+                    raise
+
+                with timed(COMDIRECT_SECONDS, endpoint='validate_response'):
+                    comdirect_connector.validate_response()
+                with timed(COMDIRECT_SECONDS, endpoint='oauth_secondary'):
+                    comdirect_connector.oath_secondary()
+                os.remove(connector_state_file)
             
             id_file_path = path.join(path.dirname(config_file), self.config_dict["id_file"])
             if not path.exists(id_file_path):
@@ -64,11 +76,11 @@ class YNABComdirectConfig:
                 use_csv=self.config_dict.get("use_csv", False),
                 account_id=self.config_dict["account_id"],
                 budget_id=self.config_dict["budget_id"],
+                archive_dir=archive_dir_from_config(self.config_dict, config_file),
+                progress=progress,
             )
             
             adapter.create_comdirect_transactions(
                 from_date=self.config_dict["from_date"],
             )
-            
-            os.remove(connector_state_file)
             return
\ No newline at end of file
@@ -1,53 +1,92 @@
 import pandas as pd
 from base import base_ynab_adapter
+from base.parsing import parse_amounts, parse_dates
+from base.upload import open_upload
 import ynab
 import hashlib
 
 class CSVYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
-   def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id=None, account_id=None, csv_mapping=None, csv_separator=';'):
-       super(CSVYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv)
+   SOURCE = 'csv'
+
+   def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id=None, account_id=None, csv_mapping=None, csv_separator=';',
+                amount_locale='de', parse_cache=None, archive_dir=None,
+                progress=None):
+       super(CSVYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv,
+                                            parse_cache=parse_cache, archive_dir=archive_dir,
+                                            progress=progress)
        self.budget_id = budget_id
        self.account_id = account_id
        self.csv_mapping = csv_mapping or {}
        self.csv_separator = csv_separator
+       self.amount_locale = amount_locale
+
+   def _parse_options(self):
+      return {'csv_mapping': self.csv_mapping, 'csv_separator': self.csv_separator,
+              'amount_locale': self.amount_locale}
+
+   def _column(self, df, key, default):
+      """Raw column for a csv_mapping key, or None if the CSV does not have it"""
+      name = self.csv_mapping.get(key, default)
+      return df[name] if name in df.columns else None
 
-   def _generate_import_id(self, row, date, amount, payee, memo):
+   def _generate_import_ids(self, df, dates, amounts, payees, memos):
+      """Import IDs for the whole batch in one pass, repeated rows get occurrence suffixes"""
       if 'import_id' in self.csv_mapping:
-          return f"CSV.{row[self.csv_mapping['import_id']]}"
-      else:
-          hash_string = f"{date}{abs(amount)}{payee}{memo}"
-          return f"CSV.{hashlib.md5(hash_string.encode()).hexdigest()[:12]}"
+          return 'CSV.' + df[self.csv_mapping['import_id']].astype(str)
+      return pd.Series(self._with_occurrences(
+          "CSV." + hashlib.md5(f"{date}{abs(amount)}{payee}{memo}".encode()).hexdigest()[:12]
+          for date, amount, payee, memo in zip(dates, amounts, payees, memos)
+      ), index=df.index)
+
+   def _normalize_transactions(self, df, from_date=None):
+       """Resolve the csv_mapping columns once and build a ready-to-send batch"""
+       trans_date = parse_dates(df[self.csv_mapping.get('date', 'Buchungstag')], '%d.%m.%Y')
+       if from_date:
+           in_range = trans_date >= from_date
+           df = df[in_range]
+           trans_date = trans_date[in_range]
+
+       amount = parse_amounts(df[self.csv_mapping.get('amount', 'Betrag')], locale=self.amount_locale)
+
+       # Raw values keep the import ID hash identical to earlier imports (NaN hashes as 'nan')
+       payee = self._column(df, 'payee', 'Name Zahlungsbeteiligter')
+       memo = self._column(df, 'memo', 'Verwendungszweck')
+       raw_payee = payee.astype(object).tolist() if payee is not None else [''] * len(df)
+       raw_memo = memo.astype(object).tolist() if memo is not None else [''] * len(df)
+
+       import_id = self._generate_import_ids(df, trans_date.tolist(), amount.tolist(), raw_payee, raw_memo)
+
+       def as_text(column, length):
+           if column is None:
+               return pd.Series('', index=df.index)
+           return column.fillna('').astype(str).str[:length]
+
+       return pd.DataFrame({
+           'import_id': import_id,
+           'trans_date': trans_date,
+           'amount': amount,
+           'payee_name': as_text(payee, 50),
+           'memo': as_text(memo, 200)
+       })
 
    def create_csv_transactions(self, csv_path, from_date=None):
        if not self.account_id or not self.budget_id:
            raise ValueError("Both account_id and budget_id must be provided")
 
-       df = pd.read_csv(csv_path, sep=self.csv_separator)
-       api_instance = ynab.TransactionsApi(ynab.ApiClient(self.configuration)) if not self.use_csv else None
-
-       for _, row in df.iterrows():
-           date = row[self.csv_mapping.get('date', 'Buchungstag')]
-           amount = float(str(row[self.csv_mapping.get('amount', 'Betrag')]).replace(',', '.'))
-           payee = row.get(self.csv_mapping.get('payee', 'Name Zahlungsbeteiligter'), '')
-           memo = row.get(self.csv_mapping.get('memo', 'Verwendungszweck'), '')
-
-           trans_date = pd.to_datetime(date, format='%d.%m.%Y').strftime('%Y-%m-%d')
-           
-           if from_date and trans_date < from_date:
-               continue
-
-           import_id = self._generate_import_id(row, trans_date, amount, payee, memo)
-
-           self._create_transaction(
-               amount=amount,
-               memo=str(memo)[:200],
-               payee_name=str(payee)[:50],
-               trans_date=trans_date,
-               account_id=self.account_id,
-               api_instance=api_instance,
-               import_id=import_id,
-               cleared='cleared'
-           )
+       api_instance = ynab.TransactionsApi(self._api_client()) if not self.use_csv else None
+
+       def batches(upload):
+           # Amounts are read as text so "1.234" is not mistaken for a decimal by pandas
+           with open_upload(upload) as file_object:
+               df = pd.read_csv(file_object, sep=self.csv_separator,
+                                dtype={self.csv_mapping.get('amount', 'Betrag'): str})
+           yield self._normalize_transactions(df, from_date=from_date)
+
+       # csv_path may also be a list of files, which are parsed in parallel and sent together
+       uploads = csv_path if isinstance(csv_path, list) else [csv_path]
+       self._import_uploads('csv', uploads, from_date, batches, api_instance)
 
        if self.use_csv:
-           self.intermediate_df.to_csv("csv_ynab_upload.csv", index=False)
\ No newline at end of file
+           self.intermediate_df.to_csv("csv_ynab_upload.csv", index=False)
+
+       self._write_archive()
\ No newline at end of file
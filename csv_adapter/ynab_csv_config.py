@@ -1,28 +1,32 @@
-import json
 from os import path
 from csv_adapter.csv_ynab_adapter import CSVYNABAdapter
+from base.config import load_config
+from base.parse_cache import parse_cache_from_config
+from base.archive import archive_dir_from_config
+from base.upload import upload_missing
 
 class YNABCSVConfig:
-   def __init__(self, config_file=None, csv=None):
-       if not path.exists(config_file):
-           raise FileNotFoundError("Config file not found")
-       if not csv or not path.exists(csv):
+   def __init__(self, config_file=None, csv=None, progress=None):
+       if upload_missing(csv):
            raise FileNotFoundError("CSV file not found")
 
-       with open(config_file, "r") as whole_config:
-           config_dict = json.load(whole_config)
+       config_dict = load_config(config_file)
 
-           adapter = CSVYNABAdapter(
-               budget_id=config_dict["budget_id"],
-               account_id=config_dict["csv_account_id"],
-               api_key=config_dict["ynab_api"],
-               idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
-               use_csv=config_dict.get("use_csv", False),
-               csv_mapping=config_dict.get("csv_mapping", {}),
-               csv_separator=config_dict.get("csv_separator", ";")
-           )
+       adapter = CSVYNABAdapter(
+           budget_id=config_dict["budget_id"],
+           account_id=config_dict["csv_account_id"],
+           api_key=config_dict["ynab_api"],
+           idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
+           use_csv=config_dict.get("use_csv", False),
+           csv_mapping=config_dict.get("csv_mapping", {}),
+           csv_separator=config_dict.get("csv_separator", ";"),
+           amount_locale=config_dict.get("csv_amount_locale", "de"),
+           parse_cache=parse_cache_from_config(config_dict, config_file),
+           archive_dir=archive_dir_from_config(config_dict, config_file),
+           progress=progress
+       )
 
-           adapter.create_csv_transactions(
-               csv_path=csv,
-               from_date=config_dict["from_date"]
-           )
\ No newline at end of file
+       adapter.create_csv_transactions(
+           csv_path=csv,
+           from_date=config_dict["from_date"]
+       )
\ No newline at end of file
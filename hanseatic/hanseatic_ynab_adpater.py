@@ -1,91 +1,382 @@
+import atexit
 import fitz  # PyMuPDF
-from datetime import datetime
+import multiprocessing
+import os
+import pandas as pd
 import re
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from base import base_ynab_adapter
+from base.parsing import GERMAN_AMOUNT_PATTERN, parse_amount, parse_date
+from base.upload import is_path, open_upload, read_upload
 import ynab
 import hashlib
 
+DATE_PATTERN = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+SKIP_PATTERN = re.compile(r'Neuer Saldo|vereinbart')
+# Statements with fewer pages are parsed in-process
+PARALLEL_MIN_PAGES = 8
+# Words whose vertical centers are closer than this (in points) share a row
+ROW_TOLERANCE = 3
+# Part of the parse cache key; bump when the parsed fields change
+PARSER_VERSION = 3
+
+
+def _page_rows(page):
+    """Group the words of a page into rows by y-position, each sorted by x-position"""
+    try:
+        words = page.get_text("words")
+    except AttributeError:
+        words = page.getTextWords()
+
+    rows = []
+    current_row = []
+    current_y = None
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        y = (word[1] + word[3]) / 2
+        if current_y is not None and abs(y - current_y) > ROW_TOLERANCE:
+            rows.append(sorted(current_row, key=lambda w: w[0]))
+            current_row = []
+        current_row.append(word)
+        current_y = y
+    if current_row:
+        rows.append(sorted(current_row, key=lambda w: w[0]))
+    return rows
+
+
+def _parse_page(page):
+    """Parse the transactions of a single statement page
+
+    Columns are read by x-position: the booking (and value) date are the
+    leading date words, the amount is the rightmost word matching an amount,
+    and the description is what lies between them. The payee is taken from
+    the row below, limited to the description column's x-range.
+    """
+    transactions = []
+    rows = _page_rows(page)
+    current_date = None
+    # Right edge of the date column, where the description column starts
+    description_left = 0
+
+    for i, row in enumerate(rows):
+        tokens = [word[4] for word in row]
+        date_count = 0
+        while date_count < len(row) and DATE_PATTERN.fullmatch(tokens[date_count]):
+            date_count += 1
+        if date_count:
+            current_date = parse_date(tokens[0], '%d.%m.%Y')
+            description_left = row[date_count - 1][2]
+        elif not current_date:
+            continue
+
+        amount_word = next((w for w in reversed(row[date_count:]) if GERMAN_AMOUNT_PATTERN.fullmatch(w[4])), None)
+        if not amount_word:
+            continue
+
+        if SKIP_PATTERN.search(' '.join(tokens)):
+            continue
+
+        description_right = amount_word[0]
+        description = ' '.join(word[4] for word in row[date_count:]
+                               if word is not amount_word and _in_column(word, description_left, description_right))
+
+        payee = ''
+        if i + 1 < len(rows) and not DATE_PATTERN.fullmatch(rows[i + 1][0][4]):
+            payee = ' '.join(word[4] for word in rows[i + 1]
+                             if _in_column(word, description_left, description_right))
+        transactions.append({
+            'date': current_date,
+            'description': description,
+            'amount': parse_amount(amount_word[4]),
+            'payee': payee.split()[0] if "Kartenabrechnung" in payee and payee.split() else payee
+        })
+
+    return transactions
+
+
+def _in_column(word, left, right):
+    """Whether the horizontal center of a word lies between `left` and `right`"""
+    return left <= (word[0] + word[2]) / 2 < right
+
+
+def _open_pdf(pdf):
+    """Open a statement from a path, or from memory for bytes and file objects"""
+    if is_path(pdf):
+        return fitz.open(pdf)
+    return fitz.open(stream=read_upload(pdf), filetype="pdf")
+
+
+# Processes of the pool shared by all statement imports (and tenants) of a server
+# process; by default the CPUs are split between the gunicorn workers (WEB_WORKERS,
+# exported by server/gunicorn.conf.py; a single process otherwise)
+POOL_WORKERS = int(os.getenv('HANSEATIC_POOL_WORKERS') or
+                   max(1, (os.cpu_count() or 1) // int(os.getenv('WEB_WORKERS', '1'))))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool():
+    """Process pool shared by all imports of this process, created on first use
+
+    Pool processes are started by a fork server: forking the multi-threaded
+    server process directly could copy locks held by other threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context('forkserver'))
+            atexit.register(shutdown_pool)
+        return _pool
+
+
+def shutdown_pool():
+    """Stop the shared pool's processes, e.g. when a server worker exits"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@contextmanager
+def _statement_file(pdf):
+    """Path of a statement for pool processes, spooling in-memory uploads to a temp file
+
+    Tasks then receive the path instead of a pickled copy of the whole PDF.
+    """
+    if is_path(pdf):
+        yield pdf
+        return
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
+        with open_upload(pdf) as file_object:
+            shutil.copyfileobj(file_object, temp_file)
+    try:
+        yield temp_file.name
+    finally:
+        os.unlink(temp_file.name)
+
+
+# Statement last opened by this pool worker, as (token, document)
+_worker_doc = (None, None)
+
+
+def _parse_page_range(token, pdf, start, stop):
+    """Worker entry point: parse pages [start, stop) of the statement
+
+    The opened document is kept for following ranges of the same statement,
+    recognized by `token`.
+    """
+    global _worker_doc
+    if _worker_doc[0] != token:
+        if _worker_doc[1] is not None:
+            _worker_doc[1].close()
+        _worker_doc = (token, _open_pdf(pdf))
+    transactions = []
+    for page_number in range(start, stop):
+        transactions.extend(_parse_page(_worker_doc[1][page_number]))
+    return transactions
+
+
+def _parse_statement(pdf, from_date=None):
+    """Worker entry point: parse a whole statement sequentially, one list per page"""
+    pages = []
+    cutoff = _Cutoff(from_date)
+    doc = _open_pdf(pdf)
+    try:
+        for page in doc:
+            page_transactions = _parse_page(page)
+            pages.append(page_transactions)
+            if cutoff.reached(page_transactions):
+                break
+    finally:
+        doc.close()
+    return pages
+
+
+class _Cutoff:
+    """Decides when the remaining pages of a statement can be skipped
+
+    Only statements seen to list the newest bookings first are cut off: a page
+    ends parsing if all of its bookings are before `from_date` and strictly
+    older than the oldest booking of the previous page with bookings. Pages in
+    chronological order never trigger it.
+    """
+    def __init__(self, from_date):
+        self.from_date = from_date
+        self.previous_oldest = None
+
+    def reached(self, transactions):
+        if not self.from_date or not transactions:
+            return False
+        dates = [t['date'] for t in transactions]
+        newest, oldest = max(dates), min(dates)
+        descending = self.previous_oldest is not None and newest < self.previous_oldest
+        self.previous_oldest = oldest
+        return descending and newest < self.from_date
+
+
 class HanseaticYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
-    def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id=None, account_id=None):
-        super(HanseaticYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv)
+    SOURCE = 'hanseatic'
+
+    def __init__(self, api_key=None, idfile="ids.txt", use_csv=False, budget_id=None, account_id=None,
+                 workers=None, parse_cache=None, archive_dir=None,
+                 progress=None):
+        super(HanseaticYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv,
+                                                   parse_cache=parse_cache, archive_dir=archive_dir,
+                                                   progress=progress)
         self.budget_id = budget_id
         self.account_id = account_id
+        self.workers = workers or POOL_WORKERS
+
+    def _parse_options(self):
+        return {'row_tolerance': ROW_TOLERANCE, 'parser_version': PARSER_VERSION}
 
-    def _generate_import_id(self, date, amount):
+    def _generate_import_id(self, date, amount, payee=None):
         hash_string = f"{date}{abs(amount)}"
         hash_object = hashlib.md5(hash_string.encode())
-        return f"HB.{hash_object.hexdigest()[:12]}"
+        import_id = f"HB.{hash_object.hexdigest()[:12]}"
+        if payee is None:
+            return import_id
+        return f"{import_id}.{hashlib.md5(payee.strip().encode()).hexdigest()[:8]}"
 
-    def parse_hanseatic_statement(self, pdf_path):
-        transactions = []
-        doc = fitz.open(pdf_path)
-        
-        for page in doc:
+    def _import_ids(self, dates, amounts, payees):
+        """Occurrence-aware import IDs of a batch, counted per (date, amount, payee)
+
+        IDs carry a payee digest, so different payees charging the same amount
+        on the same day never compete for one ID, whatever their order in the
+        statement; only identical bookings of one payee are told apart by
+        their `.n` occurrence. Transactions already recorded under the former
+        date-and-amount ID keep that ID, so statements imported before stay
+        deduplicated.
+        """
+        dates, amounts, payees = list(dates), list(amounts), list(payees)
+        former_ids = self._with_occurrences(
+            self._generate_import_id(date=date, amount=amount) for date, amount in zip(dates, amounts))
+        import_ids = self._with_occurrences(
+            self._generate_import_id(date=date, amount=amount, payee=payee)
+            for date, amount, payee in zip(dates, amounts, payees))
+        return [former_id if former_id in self.ids_imported else import_id
+                for former_id, import_id in zip(former_ids, import_ids)]
+
+    def iter_hanseatic_pages(self, pdf_path, from_date=None):
+        """Yield the transactions of a Hanseatic statement PDF page by page
+
+        Cumulative statements list the newest bookings first, so once every
+        booking on a page is older than `from_date` (and the pages are seen to
+        be in descending order) the remaining pages are not opened at all.
+        Statements with at least PARALLEL_MIN_PAGES pages are parsed in the
+        shared process pool, at most `self.workers` page ranges at a time; with
+        a `from_date` pages are handed out in windows of one page per worker so
+        early termination still applies.
+
+        `pdf_path` may also be a bytes buffer or binary file object, which is
+        parsed from memory, or for the pool from one temp file copy.
+        """
+        if not is_path(pdf_path):
+            pdf_path = read_upload(pdf_path)
+        doc = _open_pdf(pdf_path)
+        page_count = len(doc)
+        workers = min(self.workers, page_count)
+
+        cutoff = _Cutoff(from_date)
+
+        if page_count < PARALLEL_MIN_PAGES or workers < 2:
             try:
-                text = page.get_text("text")
-            except AttributeError:
-                text = page.getText()
-            lines = text.split('\n')
-            current_date = None
-            
-            for i, line in enumerate(lines):
-                date_match = re.match(r'(\d{2}\.\d{2}\.\d{4})', line)
-                if date_match:
-                    current_date = datetime.strptime(date_match.group(1), '%d.%m.%Y').strftime('%Y-%m-%d')
-                    
-                    amount_match = re.search(r'(-?\d+,\d{2})', line)
-                    if amount_match:
-                        amount = float(amount_match.group(1).replace(',', '.'))
-                        description = ' '.join(line.split())
-                        payee = lines[i + 1]
-                        if description.find("Neuer Saldo") == -1 and description.find("vereinbart") == -1:
-                            transactions.append({
-                                'date': current_date,
-                                'description': description,
-                                'amount': amount,
-                                'payee': payee.split()[0] if "Kartenabrechnung" in payee else payee
-                            })
-                
-                elif current_date and re.search(r'(-?\d+,\d{2})', line):
-                    amount_match = re.search(r'(-?\d+,\d{2})', line)
-                    amount = float(amount_match.group(1).replace(',', '.'))
-                    description = ' '.join(line.split())
-                    payee = lines[i + 1]
-                    if description.find("Neuer Saldo") == -1 and description.find("vereinbart") == -1:
-                        transactions.append({
-                            'date': current_date,
-                            'description': description,
-                            'amount': amount,
-                            'payee': payee.split()[0] if "Kartenabrechnung" in payee else payee
-                        })
-        
+                for page_number in range(page_count):
+                    page_transactions = _parse_page(doc[page_number])
+                    yield page_transactions
+                    if cutoff.reached(page_transactions):
+                        print(f"Stopping at page {page_number + 1}/{page_count}: all bookings before {from_date}",
+                              flush=True)
+                        return
+            finally:
+                doc.close()
+            return
         doc.close()
+
+        if from_date:
+            ranges = [(start, start + 1) for start in range(page_count)]
+            window = workers
+        else:
+            step = -(-page_count // workers)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            window = len(ranges)
+
+        executor = _shared_pool()
+        token = uuid.uuid4().hex
+        futures = []
+        with _statement_file(pdf_path) as statement_path:
+            try:
+                for offset in range(0, len(ranges), window):
+                    futures = [executor.submit(_parse_page_range, token, statement_path, start, stop)
+                               for start, stop in ranges[offset:offset + window]]
+                    for future, (start, _) in zip(futures, ranges[offset:offset + window]):
+                        page_transactions = future.result()
+                        yield page_transactions
+                        if cutoff.reached(page_transactions):
+                            print(f"Stopping at page {start + 1}/{page_count}: all bookings before {from_date}",
+                                  flush=True)
+                            return
+            finally:
+                for future in futures:
+                    future.cancel()
+                # The temp file is removed next; wait until no process still reads it
+                for future in futures:
+                    if not future.cancelled():
+                        future.exception()
+
+    def parse_hanseatic_statement(self, pdf_path, from_date=None):
+        """Parse the transactions of a Hanseatic statement PDF into one list"""
+        transactions = []
+        for page_transactions in self.iter_hanseatic_pages(pdf_path, from_date=from_date):
+            transactions.extend(page_transactions)
         return transactions
 
+    def _normalize_transactions(self, transactions, from_date=None):
+        """Turn parsed statement transactions into a ready-to-send batch"""
+        batch = pd.DataFrame(transactions, columns=['date', 'description', 'amount', 'payee'])
+        if from_date:
+            batch = batch[batch['date'] >= from_date]
+
+        return pd.DataFrame({
+            'import_id': self._import_ids(batch['date'], batch['amount'], batch['payee']),
+            'trans_date': batch['date'].tolist(),
+            'amount': batch['amount'].tolist(),
+            'payee_name': batch['payee'].str[:50].tolist(),
+            'memo': batch['description'].str[:200].tolist()
+        })
+
     def create_hanseatic_transactions(self, pdf_path, from_date=None):
         if not self.account_id or not self.budget_id:
             raise ValueError("Both account_id and budget_id must be provided")
 
-        transactions = self.parse_hanseatic_statement(pdf_path)
-        print(transactions, flush=True)
-        api_instance = ynab.TransactionsApi(ynab.ApiClient(self.configuration)) if not self.use_csv else None
+        api_instance = ynab.TransactionsApi(self._api_client()) if not self.use_csv else None
 
-        for transaction in transactions:
-            if from_date and transaction['date'] < from_date:
-                print("Transaction lower from date", transaction['import_id'], flush=True)
-                continue
+        # pdf_path may also be a list of statements. A single statement is parsed page
+        # by page as it is sent; several are parsed one statement per pool process.
+        uploads = pdf_path if isinstance(pdf_path, list) else [pdf_path]
 
-            import_id = self._generate_import_id(date=transaction['date'], amount=transaction['amount'])
+        def batches(upload):
+            if len(uploads) > 1:
+                with _statement_file(upload) as statement_path:
+                    pages = _shared_pool().submit(_parse_statement, statement_path, from_date).result()
+            else:
+                pages = self.iter_hanseatic_pages(upload, from_date=from_date)
+            for page_transactions in pages:
+                print(page_transactions, flush=True)
+                batch = self._normalize_transactions(page_transactions, from_date=from_date)
+                if not batch.empty:
+                    yield batch
 
-            self._create_transaction(
-                amount=transaction['amount'],  # Convert to milliunits
-                memo=transaction['description'][:200],
-                payee_name=transaction['payee'][:50],
-                trans_date=transaction['date'],
-                account_id=self.account_id,
-                api_instance=api_instance,
-                import_id=import_id
-            )
+        self._import_uploads('hanseatic', uploads, from_date, batches, api_instance, workers=self.workers)
 
         if self.use_csv:
-            self.intermediate_df.to_csv("hanseatic_ynab_upload.csv", index=False)
\ No newline at end of file
+            self.intermediate_df.to_csv("hanseatic_ynab_upload.csv", index=False)
+
+        self._write_archive()
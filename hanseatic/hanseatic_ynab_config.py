@@ -1,26 +1,30 @@
-import json
 from os import path
 from hanseatic import hanseatic_ynab_adpater
+from base.config import load_config
+from base.parse_cache import parse_cache_from_config
+from base.archive import archive_dir_from_config
+from base.upload import upload_missing
 
 class YNABHanseaticConfig:
-   def __init__(self, config_file=None, pdf=None):
-       if not path.exists(config_file):
-           raise FileNotFoundError("Config file not found")
-       if not pdf or not path.exists(pdf):
+   def __init__(self, config_file=None, pdf=None, progress=None):
+       if upload_missing(pdf):
            raise FileNotFoundError("Hanseatic PDF file not found")
 
-       with open(config_file, "r") as whole_config:
-           config_dict = json.load(whole_config)
+       config_dict = load_config(config_file)
 
-           adapter = hanseatic_ynab_adpater.HanseaticYNABAdapter(
-               budget_id=config_dict["budget_id"],
-               account_id=config_dict["hanseatic_account_id"],
-               api_key=config_dict["ynab_api"],
-               idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
-               use_csv=config_dict.get("use_csv", False)
-           )
+       adapter = hanseatic_ynab_adpater.HanseaticYNABAdapter(
+           budget_id=config_dict["budget_id"],
+           account_id=config_dict["hanseatic_account_id"],
+           api_key=config_dict["ynab_api"],
+           idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
+           use_csv=config_dict.get("use_csv", False),
+           workers=config_dict.get("hanseatic_workers"),
+           parse_cache=parse_cache_from_config(config_dict, config_file),
+           archive_dir=archive_dir_from_config(config_dict, config_file),
+           progress=progress
+       )
 
-           adapter.create_hanseatic_transactions(
-               pdf_path=pdf,
-               from_date=config_dict["from_date"]
-           )
\ No newline at end of file
+       adapter.create_hanseatic_transactions(
+           pdf_path=pdf,
+           from_date=config_dict["from_date"]
+       )
\ No newline at end of file
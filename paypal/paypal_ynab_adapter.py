@@ -1,90 +1,161 @@
 # paypal_ynab_adapter.py
 import pandas as pd
-from datetime import datetime as dt
 import ynab
 from base import base_ynab_adapter
-import string
-import random
+from base.parsing import parse_amounts, parse_dates
+from base.upload import open_upload
 
 class PayPalYNABAdapter(base_ynab_adapter.BaseYNABAdapter):
-    def __init__(self, api_key=None, csv_path=None, idfile="ids.txt", use_csv=False, budget_id = None, account_id = None):
-        super(PayPalYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv)
+    SOURCE = 'paypal'
+    KEY_SEPARATOR = '\x1f'
+
+    def __init__(self, api_key=None, csv_path=None, idfile="ids.txt", use_csv=False, budget_id = None, account_id = None,
+                 chunk_size=20000, valid_transactions=None, parse_cache=None,
+                 archive_dir=None, progress=None):
+        super(PayPalYNABAdapter, self).__init__(api_key=api_key, idfile=idfile, use_csv=use_csv,
+                                                parse_cache=parse_cache, archive_dir=archive_dir,
+                                                progress=progress)
         self.csv_path = csv_path
+        self.chunk_size = chunk_size
         self.transactions = None
         self.budget_id = budget_id
         self.account_id = account_id
 
-        self.VALID_TRANSACTIONS = {
-            'Handyzahlung'.strip(): 'Abgeschlossen'.strip(),
-            'PayPal Express-Zahlung'.strip(): 'Abgeschlossen'.strip(),
-            'Bankgutschrift auf PayPal Konto'.strip(): None,  # Any status is valid
-            'Bankgutschrift auf PayPal-Konto'.strip(): None,  # Any status is valid
-            'Rückzahlung'.strip(): 'Abgeschlossen'.strip(),
-            'Zahlung im Einzugsverfahren mit Zahlungsrechnung'.strip(): 'Abgeschlossen'.strip(),
-            'Von Nutzer eingeleitete Abbuchung'.strip(): 'Abgeschlossen'.strip(),
-            'Andere'.strip(): 'Abgeschlossen'.strip(),
-            'Website-Zahlung'.strip(): 'Abgeschlossen'.strip(),
-            'Allgemeine Zahlung'.strip(): 'Abgeschlossen'.strip(),
+        self.VALID_TRANSACTIONS = valid_transactions or {
+            'Handyzahlung': 'Abgeschlossen',
+            'PayPal Express-Zahlung': 'Abgeschlossen',
+            'Bankgutschrift auf PayPal Konto': None,  # Any status is valid
+            'Bankgutschrift auf PayPal-Konto': None,  # Any status is valid
+            'Rückzahlung': 'Abgeschlossen',
+            'Zahlung im Einzugsverfahren mit Zahlungsrechnung': 'Abgeschlossen',
+            'Von Nutzer eingeleitete Abbuchung': 'Abgeschlossen',
+            'Andere': 'Abgeschlossen',
+            'Website-Zahlung': 'Abgeschlossen',
+            'Allgemeine Zahlung': 'Abgeschlossen',
         }
+        self._compile_filter()
 
-    def __get_transactions(self):
-        try:
-            data = pd.read_csv(self.csv_path, encoding='utf-8')
-        except UnicodeDecodeError:
-            data = pd.read_csv(self.csv_path, encoding='iso-8859-1')
-
-        mask = pd.Series(False, index=data.index)
+    def _compile_filter(self):
+        """Compile VALID_TRANSACTIONS into set lookups used by _filter_valid"""
+        self._any_status_types = {
+            typ.strip() for typ, status in self.VALID_TRANSACTIONS.items() if not status
+        }
+        self._valid_keys = {
+            f"{typ.strip()}{self.KEY_SEPARATOR}{status.strip()}"
+            for typ, status in self.VALID_TRANSACTIONS.items() if status
+        }
 
-        for typ, required_status in self.VALID_TRANSACTIONS.items():
-            if required_status:
-                mask |= (
-                        (data['Typ'].str.strip() == typ) &
-                        (data['Status'].str.strip() == required_status)
-                )
-            else:
-                mask |= (data['Typ'].str.strip() == typ)
+    def _parse_options(self):
+        return {'valid_transactions': self.VALID_TRANSACTIONS}
 
-        self.transactions = data[mask]
+    def _detect_encoding(self, upload, sample_size=65536):
+        """Guess the export encoding from the first bytes of the upload"""
+        with open_upload(upload) as file_object:
+            sample = file_object.read(sample_size)
+        if sample.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        try:
+            sample.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut off at the end of the sample is still UTF-8
+            if e.start < len(sample) - 3:
+                return 'iso-8859-1'
+        return 'utf-8'
+
+    def _filter_valid(self, data):
+        """Keep only rows whose type/status combination is in VALID_TRANSACTIONS"""
+        # Strip each column once, then check both lookups in one vectorized pass
+        typ = data['Typ'].fillna('').str.strip()
+        status = data['Status'].fillna('').str.strip()
+        mask = typ.isin(self._any_status_types) | \
+            (typ + self.KEY_SEPARATOR + status).isin(self._valid_keys)
+
+        return data[mask]
+
+    def __iter_transactions(self, upload, from_date=None):
+        """Read an export in chunks of `chunk_size` rows and yield normalized batches
+
+        Memory stays bounded by the chunk size regardless of the export size.
+        `upload` is a path, bytes buffer or binary file object.
+        """
+        encoding = self._detect_encoding(upload)
+        chunks_done = 0
+        while True:
+            with open_upload(upload) as file_object:
+                reader = pd.read_csv(file_object, encoding=encoding, dtype=str, chunksize=self.chunk_size)
+                try:
+                    for index, chunk in enumerate(reader):
+                        if index < chunks_done:
+                            continue
+                        chunks_done += 1
+                        self.transactions = self._filter_valid(chunk)
+                        if not self.transactions.empty:
+                            yield self._normalize_transactions(self.transactions, from_date=from_date)
+                    return
+                except UnicodeDecodeError:
+                    # Non UTF-8 bytes after the sample: continue behind the last good chunk
+                    if encoding == 'iso-8859-1':
+                        raise
+                    encoding = 'iso-8859-1'
+
+    def _normalize_transactions(self, data, from_date=None):
+        """Turn filtered PayPal rows into a ready-to-send transaction batch
+
+        All steps run as column operations over the DataFrame.
+
+        Args:
+            data (pd.DataFrame): PayPal export rows that passed the type/status filter
+            from_date (str): Optional start date (YYYY-MM-DD)
+
+        Returns:
+            pd.DataFrame: Columns `import_id`, `trans_date`, `amount`, `payee_name`, `memo`
+        """
+        trans_date = parse_dates(data['Datum'], '%d.%m.%Y')
+        if from_date:
+            in_range = trans_date >= from_date
+            data = data[in_range]
+            trans_date = trans_date[in_range]
+
+        amount = parse_amounts(data['Brutto'], locale='de')
+
+        # Memo: "<Typ[:6]> - <Name[:10]> - <Artikelbezeichnung>", skipping empty parts
+        if 'Artikelbezeichnung' in data.columns:
+            article = data['Artikelbezeichnung'].fillna('').astype(str).str.strip()
+        else:
+            article = pd.Series('', index=data.index)
+        name = data['Name'].fillna('').astype(str)
+        memo = pd.Series('', index=data.index)
+        for part in (data['Typ'].fillna('').astype(str).str[:6].str.strip(),
+                     name.str[:10].str.strip(),
+                     article):
+            valid = (part != '') & (part != 'nan')
+            memo = memo + (' - ' + part).where(valid, '')
+        memo = memo.str[3:].str[:200]
+
+        payee = name.str.strip() \
+            .where(data['Name'].notna(), 'Transfer Comdirect') \
+            .str[:50]
+
+        return pd.DataFrame({
+            'import_id': 'PP.' + data['Transaktionscode'].astype(str),
+            'trans_date': trans_date,
+            'amount': amount,
+            'payee_name': payee,
+            'memo': memo
+        })
 
     def create_paypal_transactions(self, from_date=None):
         if not self.account_id or not self.budget_id:
             raise ValueError("Both account_id and budget_id must be provided")
 
-        self.__get_transactions()
-
-        api_instance = ynab.TransactionsApi(ynab.ApiClient(self.configuration)) if not self.use_csv else None
-
-        for _, transaction in self.transactions.iterrows():
-            trans_date = dt.strptime(transaction['Datum'], '%d.%m.%Y').strftime('%Y-%m-%d')
+        api_instance = ynab.TransactionsApi(self._api_client()) if not self.use_csv else None
 
-            if from_date and trans_date < from_date:
-                continue
-
-            amount_str = str(transaction['Brutto']).replace('.', '').replace(',', '.')
-            trans_amount = float(amount_str)
-
-            memo_parts = [
-                str(transaction['Typ'])[:6].strip(),
-                str(transaction['Name'])[:10].strip(),
-                str(transaction.get('Artikelbezeichnung', '')).strip()
-            ]
-            trans_memo = ' - '.join(filter(lambda x: x and x != 'nan', memo_parts))
-            trans_memo = trans_memo[:200]
-
-            trans_payee = str(transaction['Name']).strip() if pd.notna(transaction['Name']) else 'Transfer Comdirect'
-            trans_payee = trans_payee[:50]
-
-            import_id = 'PP.' + transaction['Transaktionscode']
-
-            self._create_transaction(
-                amount=trans_amount,
-                memo=trans_memo,
-                payee_name=trans_payee,
-                trans_date=trans_date,
-                account_id=self.account_id,
-                api_instance=api_instance,
-                import_id=import_id
-            )
+        # csv_path may also be a list of exports, which are parsed in parallel and sent together
+        uploads = self.csv_path if isinstance(self.csv_path, list) else [self.csv_path]
+        self._import_uploads('paypal', uploads, from_date,
+                             lambda upload: self.__iter_transactions(upload, from_date=from_date), api_instance)
 
         if self.use_csv:
-            self.intermediate_df.to_csv("paypal_ynab_upload.csv", index=False)
\ No newline at end of file
+            self.intermediate_df.to_csv("paypal_ynab_upload.csv", index=False)
+
+        self._write_archive()
@@ -1,29 +1,34 @@
-import json
 from os import path
 from paypal import paypal_ynab_adapter
+from base.config import load_config
+from base.parse_cache import parse_cache_from_config
+from base.archive import archive_dir_from_config
+from base.upload import upload_missing
 
 class YNABPayPalConfig:
-    def __init__(self, config_file=None, csv=None):
-        if not path.exists(config_file):
-            raise FileNotFoundError("Config file not found")
-        if not csv or not path.exists(csv):
+    def __init__(self, config_file=None, csv=None, progress=None):
+        if upload_missing(csv):
             raise FileNotFoundError("PayPal CSV file not found")
 
-        with open(config_file, "r") as whole_config:
-            config_dict = json.load(whole_config)
+        config_dict = load_config(config_file)
 
-            adapter = paypal_ynab_adapter.PayPalYNABAdapter(
-                budget_id=config_dict["budget_id"],
-                account_id=config_dict["paypal_account_id"],
-                api_key=config_dict["ynab_api"],
-                csv_path=csv,
-                idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
-                use_csv=config_dict.get("use_csv", False)
-            )
+        adapter = paypal_ynab_adapter.PayPalYNABAdapter(
+            budget_id=config_dict["budget_id"],
+            account_id=config_dict["paypal_account_id"],
+            api_key=config_dict["ynab_api"],
+            csv_path=csv,
+            idfile=path.join(path.dirname(config_file), config_dict["id_file"]),
+            use_csv=config_dict.get("use_csv", False),
+            chunk_size=config_dict.get("paypal_chunk_size", 20000),
+            valid_transactions=config_dict.get("paypal_valid_transactions"),
+            parse_cache=parse_cache_from_config(config_dict, config_file),
+            archive_dir=archive_dir_from_config(config_dict, config_file),
+            progress=progress
+        )
 
-            adapter.create_paypal_transactions(
-                from_date=config_dict["from_date"]
-            )
+        adapter.create_paypal_transactions(
+            from_date=config_dict["from_date"]
+        )
 
 if __name__ == '__main__':
     YNABPayPalConfig(
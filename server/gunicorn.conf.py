@@ -0,0 +1,48 @@
+# Production settings, started with `gunicorn -c server/gunicorn.conf.py server.server:app`
+import glob
+import os
+import sys
+
+# Workers write their metrics here for /metrics to aggregate; set before prometheus_client is imported
+METRICS_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/ynab_metrics')
+
+from server.jobs import JobStore, JOBS_DB
+
+bind = '0.0.0.0:' + os.getenv('PORT', '80')
+workers = int(os.getenv('WEB_WORKERS', '2'))
+# Threads let each worker accept several uploads while imports run in the job pool
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '4'))
+timeout = 120
+# On SIGTERM workers get this long to finish running imports before they are killed
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '120'))
+
+
+def on_starting(server):
+    """Fail jobs a previous container left behind, once, before any worker starts"""
+    JobStore(JOBS_DB).fail_interrupted()
+    # Workers inherit the effective count (also when set by --workers), see hanseatic POOL_WORKERS
+    os.environ['WEB_WORKERS'] = str(server.cfg.workers)
+    # Metrics start from zero with every server start
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for metrics_file in glob.glob(os.path.join(METRICS_DIR, '*.db')):
+        os.remove(metrics_file)
+
+
+def worker_exit(server, worker):
+    """Wait for running imports of the exiting worker and fail its queued ones"""
+    from server.server import job_queue
+    job_queue.shutdown(wait=True)
+    # Stop the Hanseatic parse processes, if an import of this worker started them
+    hanseatic = sys.modules.get('hanseatic.hanseatic_ynab_adpater')
+    if hanseatic is not None:
+        hanseatic.shutdown_pool()
+
+
+def child_exit(server, worker):
+    """Let /metrics drop the live values of a worker that exited"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
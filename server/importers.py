@@ -0,0 +1,44 @@
+import importlib
+import threading
+
+# type= value -> ("module:ConfigClass", label). Config classes are only
+# imported on first use, so pandas, PyMuPDF, Pillow and the ynab client are
+# loaded only for the sources a deployment actually uses.
+#
+# File importers are called as ConfigClass(config_path, upload, progress=...).
+# Comdirect has its own two-step login flow in server.py.
+IMPORTERS = {
+    'comdirect': ('comdirect.ynab_comdirect_config:YNABComdirectConfig', 'Comdirect'),
+    'paypal': ('paypal.ynab_paypal_config:YNABPayPalConfig', 'PayPal'),
+    'csv': ('csv_adapter.ynab_csv_config:YNABCSVConfig', 'CSV'),
+    'hanseatic': ('hanseatic.hanseatic_ynab_config:YNABHanseaticConfig', 'Hanseatic'),
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def register_importer(import_type, target, label=None):
+    """Add a source, `target` being "module:ConfigClass" or the class itself"""
+    IMPORTERS[import_type] = (target, label or import_type)
+    _loaded.pop(import_type, None)
+
+
+def has_importer(import_type):
+    return import_type in IMPORTERS
+
+
+def importer_label(import_type):
+    return IMPORTERS[import_type][1]
+
+
+def load_importer(import_type):
+    """Config class of a source, imported on first use"""
+    with _lock:
+        if import_type not in _loaded:
+            target = IMPORTERS[import_type][0]
+            if isinstance(target, str):
+                module_name, class_name = target.split(':')
+                target = getattr(importlib.import_module(module_name), class_name)
+            _loaded[import_type] = target
+        return _loaded[import_type]
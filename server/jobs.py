@@ -0,0 +1,226 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from base.metrics import IMPORT_JOBS, STAGE_SECONDS
+
+STATS_KEYS = ['parsed', 'sent', 'skipped', 'conflict', 'failed', 'csv']
+JOBS_DB = os.getenv('JOBS_DB', '/config/jobs.db')
+# Columns added to the jobs table after its first version, as (name, definition)
+MIGRATIONS = [
+    ('tenant', "TEXT NOT NULL DEFAULT 'default'"),
+    ('idempotency_key', "TEXT"),
+]
+# How long a repeated submission attaches to an earlier job instead of starting a new one
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', str(24 * 3600)))
+
+
+class JobStore:
+    """Durable import job state in a SQLite database
+
+    Args:
+        db_path (str): Path of the SQLite file
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            # WAL lets the server workers read job state while another one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    stats TEXT NOT NULL,
+                    message TEXT,
+                    error TEXT
+                )''')
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_tenant_created ON jobs (tenant, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_tenant_key ON jobs (tenant, idempotency_key)")
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    @staticmethod
+    def _find(conn, tenant, idempotency_key):
+        row = conn.execute(
+            "SELECT id, status, stats FROM jobs WHERE tenant = ? AND idempotency_key = ? AND created > ? "
+            "AND status IN ('queued', 'running', 'finished') ORDER BY created DESC LIMIT 1",
+            (tenant, idempotency_key, time.time() - IDEMPOTENCY_TTL)
+        ).fetchone()
+        if not row:
+            return None
+        # Re-uploading the same content retries the rows a finished job failed to
+        # send; only a key the client chose pins such a job
+        if (idempotency_key.startswith('content:') and row['status'] == 'finished'
+                and json.loads(row['stats']).get('failed')):
+            return None
+        return row['id']
+
+    def find(self, tenant, idempotency_key):
+        """Id of the tenant's queued, running or finished job with this key, or None
+
+        Failed jobs and jobs older than IDEMPOTENCY_TTL are ignored, so a retry
+        after them starts a new job. For keys derived from the upload content
+        ('content:' prefix) so are finished jobs with failed transactions.
+        """
+        if not idempotency_key:
+            return None
+        with self._connect() as conn:
+            return self._find(conn, tenant, idempotency_key)
+
+    def create(self, job_type, tenant='default', idempotency_key=None):
+        """Create a queued job and return `(job_id, created)`
+
+        With an idempotency key an existing job is returned instead of
+        creating one (`created` False). Lookup and insert run in one write
+        transaction, so concurrent submissions from several workers agree.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            if idempotency_key:
+                conn.execute("BEGIN IMMEDIATE")
+                existing = self._find(conn, tenant, idempotency_key)
+                if existing:
+                    return existing, False
+            conn.execute(
+                "INSERT INTO jobs (id, type, status, created, updated, stats, tenant, idempotency_key) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, job_type, now, now, json.dumps(dict.fromkeys(STATS_KEYS, 0)), tenant, idempotency_key)
+            )
+        return job_id, True
+
+    def count_recent(self, tenant, seconds):
+        """Number of jobs the tenant created in the last `seconds`"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE tenant = ? AND created > ?", (tenant, time.time() - seconds)
+            ).fetchone()[0]
+
+    def count_active(self, tenant):
+        """Number of the tenant's jobs that are queued or running"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE tenant = ? AND status IN ('queued', 'running')", (tenant,)
+            ).fetchone()[0]
+
+    def get(self, job_id):
+        """Return the job as a dict or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['stats'] = json.loads(job['stats'])
+        return job
+
+    def start(self, job_id):
+        self._update(job_id, status='running')
+
+    def progress(self, job_id, stats):
+        self._update(job_id, stats=json.dumps(stats))
+
+    def finish(self, job_id, message):
+        self._update(job_id, status='finished', message=message)
+
+    def fail(self, job_id, error):
+        self._update(job_id, status='failed', error=error)
+
+    def fail_interrupted(self):
+        """Mark jobs left queued or running by a previous server process as failed
+
+        Must only run while no worker is importing, i.e. before workers start.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart', updated = ? "
+                "WHERE status IN ('queued', 'running')",
+                (time.time(),)
+            )
+
+
+class JobQueue:
+    """Run import jobs on a background thread pool and track them in a JobStore
+
+    Args:
+        store (JobStore): Job state store
+        workers (int): Number of imports running in parallel
+    """
+    def __init__(self, store, workers=2):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import')
+        self._futures = {}
+
+    def submit(self, job_type, run, cleanup=None, tenant='default', idempotency_key=None):
+        """Queue `run(progress)` as a job and return `(job_id, created)`
+
+        `run` receives a progress callback taking the stats dict and returns the
+        final message. `cleanup` is called after the job, whatever its outcome.
+        If a job with the same idempotency key exists, its id is returned,
+        `run` is not queued and `cleanup` is called right away.
+        """
+        job_id, created = self.store.create(job_type, tenant, idempotency_key)
+        if not created:
+            if cleanup:
+                cleanup()
+            return job_id, False
+        future = self.executor.submit(self._run, job_id, job_type, run, cleanup, time.perf_counter())
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+        return job_id, True
+
+    def _run(self, job_id, job_type, run, cleanup, submitted):
+        started = time.perf_counter()
+        STAGE_SECONDS.labels(source=job_type, stage='queue').observe(started - submitted)
+        status = 'failed'
+        self.store.start(job_id)
+        try:
+            message = run(lambda stats: self.store.progress(job_id, stats))
+            self.store.finish(job_id, message)
+            status = 'finished'
+        except (Exception, SystemExit) as e:
+            # SystemExit comes from ComdirectConnector's exit() on API errors
+            traceback.print_exc()
+            self.store.fail(job_id, str(e))
+        finally:
+            STAGE_SECONDS.labels(source=job_type, stage='job').observe(time.perf_counter() - started)
+            IMPORT_JOBS.labels(source=job_type, status=status).inc()
+            if cleanup:
+                cleanup()
+
+    def shutdown(self, wait=True):
+        """Stop the queue: running imports finish, queued ones are failed"""
+        pending = dict(self._futures)
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        for job_id, future in pending.items():
+            if future.cancelled():
+                self.store.fail(job_id, 'Cancelled by server shutdown')
+                IMPORT_JOBS.labels(source=self.store.get(job_id)['type'], status='cancelled').inc()
@@ -1,11 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import os
 from dotenv import load_dotenv
-from comdirect.ynab_comdirect_config import YNABComdirectConfig
-from paypal.ynab_paypal_config import YNABPayPalConfig
-from hanseatic.hanseatic_ynab_config import YNABHanseaticConfig
-from csv_adapter.ynab_csv_config import YNABCSVConfig
-import tempfile
+from server.importers import has_importer, importer_label, load_importer
+from server.jobs import JobStore, JobQueue, JOBS_DB
+from server.tenants import authenticate
+from base.metrics import IMPORT_REQUESTS, render
+from base.upload import spool_upload, discard_upload, decompress_upload, expand_archives, upload_digest
+import hashlib
 import re
 from datetime import datetime
 # import debugpy
@@ -22,79 +23,162 @@ else:
 
 load_dotenv(env_path)
 
+# Single-tenant setup, used when there is no tenants file (see server/tenants.py)
 API_SECRET = os.getenv('API_SECRET')
+CONFIG_PATH = '/config/ynab_comdirect_conf.json'
+
+# Imports run as background jobs; their state survives restarts in jobs.db and
+# is shared by all server workers. Interrupted jobs are failed on startup, by
+# gunicorn's on_starting hook or in __main__ below.
+job_store = JobStore(JOBS_DB)
+job_queue = JobQueue(job_store, workers=int(os.getenv('IMPORT_WORKERS', '2')))
+# Uploads above this size are spilled to a temp file, smaller ones are imported from memory
+UPLOAD_SPILL_BYTES = int(float(os.getenv('UPLOAD_SPILL_MB', '10')) * 1024 * 1024)
+# Compressed uploads and archives may expand to at most this size, larger ones fail the job
+UPLOAD_MAX_EXPANDED_BYTES = int(float(os.getenv('UPLOAD_MAX_EXPANDED_MB', '200')) * 1024 * 1024)
 
 def validate_secret(request):
-    secret = request.headers.get('X-API-Secret')
-    return secret and secret == API_SECRET
+    """Tenant authenticated by the request's secret, or None"""
+    return authenticate(request.headers.get('X-API-Secret'), API_SECRET, CONFIG_PATH)
+
+def rate_limited(tenant):
+    """429 response if the tenant exceeds its import rate or concurrent jobs, else None"""
+    if job_store.count_recent(tenant.name, 60) >= tenant.imports_per_minute:
+        return jsonify({'error': 'Too many imports, try again later'}), 429, {'Retry-After': '60'}
+    if job_store.count_active(tenant.name) >= tenant.max_active_jobs:
+        return jsonify({'error': 'Too many imports in progress, try again later'}), 429, {'Retry-After': '10'}
+    return None
+
+def upload_encoding(file):
+    """Content-Encoding of an uploaded file, also derived from a gzip/zstd content type"""
+    return file.headers.get('Content-Encoding') or \
+        {'application/gzip': 'gzip', 'application/x-gzip': 'gzip', 'application/zstd': 'zstd'}.get(file.mimetype)
+
+def idempotency_key(request, import_type, uploads=()):
+    """Client's Idempotency-Key header, else a hash of the uploaded content, else None"""
+    if request.headers.get('Idempotency-Key'):
+        return 'client:' + request.headers['Idempotency-Key']
+    if not uploads:
+        return None
+    digest = hashlib.sha256(import_type.encode())
+    for upload in uploads:
+        digest.update(upload_digest(upload, raw=True).encode())
+    return 'content:' + digest.hexdigest()
+
+def accepted(job_id, created=True):
+    """202 for a queued job; a repeated submission gets the earlier job with `existing` set"""
+    g.import_outcome = 'accepted' if created else 'existing'
+    return jsonify({'job_id': job_id, 'status_url': f'/jobs/{job_id}', 'existing': not created}), 202
+
+@app.after_request
+def count_import(response):
+    """Count /import requests by source and outcome"""
+    if request.endpoint == 'import_data':
+        import_type = request.args.get('type')
+        source = import_type if has_importer(import_type) else 'invalid'
+        IMPORT_REQUESTS.labels(source=source, outcome=g.get('import_outcome', str(response.status_code))).inc()
+    return response
 
 @app.route('/import', methods=['POST'])
 def import_data():
-    if not validate_secret(request):
+    tenant = validate_secret(request)
+    if not tenant:
         return jsonify({'error': 'Unauthorized'}), 401
 
     import_type = request.args.get('type')
     what = request.args.get('what', '')
-    config_path = '/config/ynab_comdirect_conf.json'
+    config_path = tenant.config_path
 
     try:
         if import_type == 'comdirect':
+            comdirect_config = load_importer('comdirect')
             if what == 'start':
-                YNABComdirectConfig(config_path, start_only=True)
+                comdirect_config(config_path, start_only=True)
                 return jsonify({'message': 'Comdirect login started'})
             elif what == 'validate_tan':
-                YNABComdirectConfig(config_path, validate_only=True)
-                return jsonify({'message': 'TAN validated and import completed'})
+                key = idempotency_key(request, import_type)
+                existing = job_store.find(tenant.name, key)
+                if existing:
+                    return accepted(existing, created=False)
+                limited = rate_limited(tenant)
+                if limited:
+                    return limited
+
+                def run(progress):
+                    comdirect_config(config_path, validate_only=True, progress=progress)
+                    return 'TAN validated and import completed'
+                return accepted(*job_queue.submit('comdirect', run, tenant=tenant.name, idempotency_key=key))
             else:
                 return jsonify({'error': 'Invalid what parameter'}), 400
-            
-        elif import_type == 'paypal':
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file provided'}), 400
-                
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
-                
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                file.save(temp_file.name)
-                YNABPayPalConfig(config_path, csv=temp_file.name)
-            os.unlink(temp_file.name)
-            return jsonify({'message': 'PayPal import successful'})
-        
-        elif import_type == 'csv':
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file provided'}), 400
-                
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
-                
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                file.save(temp_file.name)
-                YNABCSVConfig(config_path, csv=temp_file.name)
-            os.unlink(temp_file.name)
-            return jsonify({'message': 'CSV import successful'})
-        
-        elif import_type == 'hanseatic':
+
+        elif has_importer(import_type):
             if 'file' not in request.files:
                 return jsonify({'error': 'No file provided'}), 400
-                
-            file = request.files['file']
-            if file.filename == '':
+
+            # Several `file` fields and ZIP/tar archives are imported as one job
+            files = [file for file in request.files.getlist('file') if file.filename != '']
+            if not files:
                 return jsonify({'error': 'No file selected'}), 400
 
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                file.save(temp_file.name)
-                YNABHanseaticConfig(config_path, temp_file.name)
-            os.unlink(temp_file.name)
-            return jsonify({'message': 'Hanseatic import successful'})
-            
+            # gzip/zstd uploads stay compressed and are decompressed while being parsed
+            uploads = [decompress_upload(spool_upload(file.stream, UPLOAD_SPILL_BYTES), upload_encoding(file),
+                                         UPLOAD_MAX_EXPANDED_BYTES)
+                       for file in files]
+
+            def cleanup():
+                for upload in uploads:
+                    discard_upload(upload)
+
+            # A retried submission attaches to the job already importing the same content
+            key = idempotency_key(request, import_type, uploads)
+            existing = job_store.find(tenant.name, key)
+            if existing:
+                cleanup()
+                return accepted(existing, created=False)
+            limited = rate_limited(tenant)
+            if limited:
+                cleanup()
+                return limited
+
+            def run(progress):
+                members = expand_archives(uploads, UPLOAD_SPILL_BYTES, UPLOAD_MAX_EXPANDED_BYTES)
+                try:
+                    if not members:
+                        raise ValueError('Archive contains no files')
+                    load_importer(import_type)(config_path, members if len(members) > 1 else members[0],
+                                               progress=progress)
+                finally:
+                    for member in members:
+                        discard_upload(member)
+                return f'{importer_label(import_type)} import successful'
+
+            return accepted(*job_queue.submit(import_type, run, cleanup=cleanup, tenant=tenant.name,
+                                              idempotency_key=key))
+
         else:
             return jsonify({'error': 'Invalid import type'}), 400
-            
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    tenant = validate_secret(request)
+    if not tenant:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = job_store.get(job_id)
+    if not job or job['tenant'] != tenant.name:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of all workers; carries no tenant data, so no secret is required"""
+    body, content_type = render()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
\ No newline at end of file
+    # Development server, run from the repository root with `python -m server.server`
+    job_store.fail_interrupted()
+    app.run(host='0.0.0.0', port=80)
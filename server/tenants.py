@@ -0,0 +1,59 @@
+import hmac
+import os
+from collections import namedtuple
+from os import path
+
+from base.config import load_config
+
+TENANTS_FILE = os.getenv('TENANTS_FILE', '/config/tenants.json')
+
+# config_path: the tenant's config JSON. Its directory holds the tenant's id
+# file, Comdirect session and parse cache, so tenants never share state.
+Tenant = namedtuple('Tenant', ['name', 'config_path', 'imports_per_minute', 'max_active_jobs'])
+
+
+def load_tenants(default_secret, default_config):
+    """Map each API secret to its Tenant
+
+    Tenants are read from TENANTS_FILE (re-read when it changes), e.g.
+
+        {"alice": {"secret": "...", "config": "alice/ynab_comdirect_conf.json",
+                   "imports_per_minute": 10, "max_active_jobs": 2}}
+
+    with config paths relative to the tenants file. Each tenant's config must
+    be in a directory of its own (ValueError otherwise). Without a tenants file
+    the deployment has a single `default` tenant using `default_secret` and
+    `default_config`.
+    """
+    if not path.exists(TENANTS_FILE):
+        if not default_secret:
+            return {}
+        return {default_secret: Tenant('default', default_config, 10, 2)}
+
+    tenants = {}
+    state_dirs = {}
+    for name, settings in load_config(TENANTS_FILE).items():
+        config_path = path.join(path.dirname(TENANTS_FILE), settings['config'])
+        # A shared directory would silently share the id file, session and cache
+        state_dir = path.realpath(path.dirname(config_path))
+        if state_dir in state_dirs:
+            raise ValueError(f"Tenants {state_dirs[state_dir]} and {name} keep their configs in the same "
+                             f"directory {state_dir}; every tenant needs its own")
+        state_dirs[state_dir] = name
+        tenants[settings['secret']] = Tenant(
+            name=name,
+            config_path=config_path,
+            imports_per_minute=settings.get('imports_per_minute', 10),
+            max_active_jobs=settings.get('max_active_jobs', 2)
+        )
+    return tenants
+
+
+def authenticate(secret, default_secret, default_config):
+    """Tenant owning the secret, or None"""
+    if not secret:
+        return None
+    for tenant_secret, tenant in load_tenants(default_secret, default_config).items():
+        if hmac.compare_digest(secret.encode(), tenant_secret.encode()):
+            return tenant
+    return None